@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -120,6 +121,93 @@ USE_TZ = True
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [BASE_DIR / "static"]
 
+# Caches
+# The heartbeat store and the disk usage history have to be shared by the
+# daemons and the web processes on this host, so they can't be the (per
+# process) local memory cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'heartbeats': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/tmp/djangoTest_heartbeats',
+    },
+    'disk_usage': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': '/tmp/djangoTest_disk_usage',
+    },
+}
+
+# mdb: daemon heartbeats are written to the DB at most this often (seconds);
+# keep it well under the 60 seconds after which a heartbeat is not recent
+HEARTBEAT_FLUSH_INTERVAL = 15
+
+# mdb: seconds the /mdb/status/ JSON is cached on the server
+STATUS_JSON_CACHE_SECONDS = 2
+
+# Where the YGOR config files (system.conf, cycspec.conf) and logs live
+YGOR_TELESCOPE = os.environ.get('YGOR_TELESCOPE', '/home/gbt')
+
+# How utils.py runs commands on the bank hosts: 'fabric' (SSH), 'local'
+# or 'simulated'; see transports.py.  SIMULATED_TRANSPORT holds the
+# keyword arguments for transports.SimulatedTransport.
+COMMAND_TRANSPORT = 'fabric'
+SIMULATED_TRANSPORT = {}
+
+# transports.ConnectionPool: how many idle SSH connections to keep, and for how long (seconds)
+SSH_POOL_MAX_IDLE = 48
+SSH_POOL_IDLE_TIMEOUT = 300
+SSH_CONNECT_TIMEOUT = 5
+
+# utils.probeExecutor: concurrent remote probes, and how long (seconds)
+# to wait for a batch before calling the stragglers PROBE_UNKNOWN
+PROBE_MAX_WORKERS = 24
+PROBE_TIMEOUT = 10
+
+# mdb: HostProcessSnapshots (from poll_host_processes) older than this
+# many seconds are ignored, and the remote hosts are asked directly
+HOST_SNAPSHOT_MAX_AGE = 60
+
+# utils.getBankHost: how often (seconds) to check system.conf for changes
+SYSTEM_CONF_CHECK_INTERVAL = 5
+
+# utils.diskUsageSampler: reuse a mount's statvfs for this many seconds,
+# with at most this many statvfs calls at once, and keep this many samples
+# per mount for fill rates (a day at the default ttl) in this cache
+DISK_USAGE_TTL = 60
+DISK_USAGE_WORKERS = 4
+DISK_USAGE_HISTORY = 1440
+DISK_USAGE_CACHE = 'disk_usage'
+
+# utils.parsePulsarName: how many parsed file names to remember, for
+# callers that parse the same names again (ingest parses each new file once)
+PULSAR_FILENAME_CACHE_SIZE = 65536
+
+# utils.logIndex: where to keep the sidecar timestamp indexes of the
+# cycspec logs, and how many bytes of log per index entry
+LOG_INDEX_DIR = '/tmp/djangoTest_log_index'
+LOG_INDEX_STRIDE = 65536
+
+# mdb: mark-files-deleted requests for more files than this run in the background
+MARK_FILES_DELETED_BACKGROUND_THRESHOLD = 10000
+
+# mdb.jobs: how often (seconds) a running BackgroundJob records a heartbeat,
+# and how long without one before job_progress marks it FAILED
+JOB_HEARTBEAT_INTERVAL = 10
+JOB_STALE_SECONDS = 60
+
+# mdb.reconcile: how many directories to list at once when checking Files against the disk
+RECONCILE_WORKERS = 16
+
+# mdb.ingest: files per insert transaction, seconds between walks of the data
+# dir (or to wait for inotify events), and, when walking, how long a file must
+# go unmodified before it's considered written
+INGEST_BATCH_SIZE = 1000
+INGEST_INTERVAL = 5
+INGEST_SETTLE_SECONDS = 10
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -6,5 +6,6 @@ def landing_page(request):
         {"url": "/mdb/scans/", "name": "Scan List", "desc": "List all scans with filter."},
         {"url": "/mdb/set-processing-state/", "name": "Set Processing State", "desc": "Form to set processing state for processing objects."},
         {"url": "/mdb/mark-files-deleted/", "name": "Mark Files as Deleted", "desc": "Form to mark files as deleted by project, scan, and bank."},
+        {"url": "/mdb/status/", "name": "Status JSON", "desc": "Status and bank status for the control room, as JSON."},
     ]
     return render(request, "landing_page.html", {"urls": urls})
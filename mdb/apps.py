@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MdbConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'mdb'
+
+    def ready(self):
+        # connect the ScanSummary bookkeeping
+        from . import signals
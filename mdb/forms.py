@@ -8,17 +8,25 @@ class MarkFilesDeletedForm(forms.Form):
     bank = forms.ModelChoiceField(queryset=Bank.objects.all(), label='Bank', required=False, empty_label='All Banks')
 
     def get_files(self):
-        projectId = self.cleaned_data['projectId']
-        scanNum = self.cleaned_data.get('scanNum')
+        return self.files_for(**self.get_params())
+
+    def get_params(self):
+        "JSON friendly version of the cleaned data, for handing off to a BackgroundJob"
         bank = self.cleaned_data.get('bank')
+        return dict(projectId=self.cleaned_data['projectId'],
+                    scanNum=self.cleaned_data.get('scanNum'),
+                    bankId=bank.id if bank else None)
+
+    @staticmethod
+    def files_for(projectId, scanNum=None, bankId=None):
         from .models import Scan, File
         if scanNum:
             scans = Scan.objects.filter(projectId=projectId, scanNum=scanNum)
         else:
             scans = Scan.objects.filter(projectId=projectId)
         files = File.objects.filter(scan__in=scans)
-        if bank:
-            files = files.filter(bank=bank)
+        if bankId:
+            files = files.filter(bank_id=bankId)
         return files
 
 
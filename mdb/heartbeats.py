@@ -0,0 +1,108 @@
+"""
+Write coalescing store for the daemons' heartbeats.
+
+The processing and quality check daemons beat every few seconds; writing
+each of those straight to the DB fights the web process for the SQLite
+lock.  Instead, beats go to the shared 'heartbeats' cache and are flushed
+to Status / BankStatus / BankStatusX in one transaction at most every
+HEARTBEAT_FLUSH_INTERVAL seconds.  Readers check the cache first, so they
+still see the latest beat.
+"""
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from utils import getDt
+
+HEARTBEAT_CACHE = getattr(settings, 'HEARTBEAT_CACHE', 'heartbeats')
+HEARTBEAT_FLUSH_INTERVAL = getattr(settings, 'HEARTBEAT_FLUSH_INTERVAL', 15) # seconds
+
+# the heartbeat fields we know how to store
+PROCESSING = 'processingHeartbeat'
+QUALITY_CHECK = 'qualityCheckHeartbeat'
+STATUS = 'heartbeat'
+BANK_STATUS_MODELS = ['BankStatus', 'BankStatusX']
+
+FLUSH_LOCK_KEY = 'hb:flush-lock'
+
+
+def getCache():
+    return caches[HEARTBEAT_CACHE]
+
+def getKey(modelName, field, bankName=None):
+    return "hb:%s:%s:%s" % (modelName, field, bankName or '')
+
+def allKeys():
+    "Every heartbeat we could have in the store"
+    from mdb.models import BANKNAMES
+    keys = [('Status', STATUS, None)]
+    for modelName in BANK_STATUS_MODELS:
+        for field in (PROCESSING, QUALITY_CHECK):
+            keys.extend([(modelName, field, b) for b in BANKNAMES])
+    return keys
+
+def beat(field, bankName=None, modelName='BankStatus', dt=None):
+    "Record a heartbeat; it gets to the DB on the next flush"
+    if dt is None:
+        dt = getDt()
+    if field == STATUS:
+        modelName = 'Status'
+    getCache().set(getKey(modelName, field, bankName), dt, timeout=None)
+    # whoever beats first after the interval is up does the flush
+    if getCache().add(FLUSH_LOCK_KEY, True, timeout=HEARTBEAT_FLUSH_INTERVAL):
+        flush()
+
+def beatProcessing(bankName, modelName='BankStatus', dt=None):
+    beat(PROCESSING, bankName, modelName=modelName, dt=dt)
+
+def beatQualityCheck(bankName, modelName='BankStatus', dt=None):
+    beat(QUALITY_CHECK, bankName, modelName=modelName, dt=dt)
+
+def beatStatus(dt=None):
+    beat(STATUS, dt=dt)
+
+def getStored():
+    "All the heartbeats in the store in one go, for passing to getHeartbeat"
+    return getCache().get_many([getKey(*k) for k in allKeys()])
+
+def getHeartbeat(obj, field, stored=None):
+    "Latest heartbeat for this Status/BankStatus(X) object, from the store or the DB"
+    modelName = obj.__class__.__name__
+    bankName = None if modelName == 'Status' else obj.bank.name
+    key = getKey(modelName, field, bankName)
+    dt = getCache().get(key) if stored is None else stored.get(key)
+    dbDt = getattr(obj, field)
+    if dt is None or (dbDt is not None and dbDt > dt):
+        return dbDt
+    return dt
+
+def flush():
+    "Write all the stored heartbeats to the DB with one UPDATE per model and field"
+    keys = allKeys()
+    values = getStored()
+    if not values:
+        return 0
+    Bank = apps.get_model('mdb', 'Bank')
+    bankIds = dict(Bank.objects.values_list('name', 'id'))
+    updates = {}
+    for modelName, field, bankName in keys:
+        dt = values.get(getKey(modelName, field, bankName))
+        if dt is not None:
+            updates.setdefault((modelName, field), {})[bankName] = dt
+    n = 0
+    with transaction.atomic():
+        for (modelName, field), beats in updates.items():
+            model = apps.get_model('mdb', modelName)
+            if modelName == 'Status':
+                n += model.objects.update(**{field: beats[None]})
+                continue
+            whens = [When(bank_id=bankIds[b], then=Value(dt)) for b, dt in beats.items() if b in bankIds]
+            if whens:
+                n += model.objects.filter(bank_id__in=[bankIds[b] for b in beats if b in bankIds]).update(
+                    **{field: Case(*whens, output_field=model._meta.get_field(field))})
+    logging.debug("flushed %d heartbeat rows" % n)
+    return n
@@ -0,0 +1,303 @@
+"""
+Ingest new VEGAS data files into Scan and File rows as they're written.
+
+The data dir (VEGAS_DATA_DIR in cycspec.conf) is laid out the way
+File.getFullPath() expects:
+
+    <data dir>/<project>/<deviceDir>/<bank>/<filename>
+
+New files are found with inotify (if inotify_simple is installed and
+we're on the host that writes them), or else by walking the data dir,
+only listing the bank directories that have changed since the last
+walk.  Either way they're parsed, and upserted in batches: Scans that
+don't exist yet are made from what the filenames tell us, and Files are
+bulk_created, ignoring the ones that are already there.
+"""
+import logging
+import os
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.db import transaction
+
+from utils import parsePulsarName
+from .models import Bank, File, Scan, ScanSummary
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+INGEST_BATCH_SIZE = getattr(settings, 'INGEST_BATCH_SIZE', 1000)
+INGEST_INTERVAL = getattr(settings, 'INGEST_INTERVAL', 5) # seconds
+# when polling, a file that's been modified more recently than this
+# is assumed to still be being written
+INGEST_SETTLE_SECONDS = getattr(settings, 'INGEST_SETTLE_SECONDS', 10)
+
+# project, deviceDir, bank: how deep the files are in the data dir
+LAYOUT_DEPTH = 3
+
+MJD_EPOCH = datetime(1858, 11, 17, tzinfo=timezone.utc)
+
+DataFile = namedtuple('DataFile', ['projectId', 'deviceDir', 'bankName', 'filename', 'fileType',
+                                   'scanNum', 'fileNum', 'source', 'startTime', 'mtime', 'size'])
+
+
+def parseDataPath(dataDir, path):
+    "A DataFile for a file in the data dir, or None if it's not one of ours"
+    parts = os.path.relpath(path, dataDir).split(os.sep)
+    if len(parts) != LAYOUT_DEPTH + 1:
+        return None
+    projectId, deviceDir, bankName, filename = parts
+    try:
+        name = parsePulsarName(filename)
+        st = os.stat(path)
+    except (ValueError, OSError) as e:
+        logging.debug("Skipping %s: %s" % (path, e))
+        return None
+    startTime = MJD_EPOCH + timedelta(days=name.mjd, seconds=name.seconds)
+    mtime = datetime.fromtimestamp(st.st_mtime, tz=timezone.utc)
+    return DataFile(projectId, deviceDir, bankName, filename, name.extension,
+                    name.scanNum, name.fileNum, name.source, startTime, mtime, st.st_size)
+
+def getScans(dataFiles):
+    """
+    {(projectId, scanNum): scan id} for these files, making the Scans we
+    don't have yet, and marking them cycspec if any of their files are raw
+    """
+    wanted = {}
+    raw = set()
+    for df in dataFiles:
+        key = (df.projectId, df.scanNum)
+        # the earliest file we've seen tells us when the scan started
+        if key not in wanted or df.startTime < wanted[key].startTime:
+            wanted[key] = df
+        if df.fileType == 'raw':
+            raw.add(key)
+
+    def existing():
+        scanNums = {}
+        for projectId, scanNum in wanted:
+            scanNums.setdefault(projectId, []).append(scanNum)
+        found = {}
+        for projectId, nums in scanNums.items():
+            qs = Scan.objects.filter(projectId=projectId, scanNum__in=nums)
+            # if there's more than one, use the first, like the forms do
+            for scanId, scanNum in qs.order_by('-id').values_list('id', 'scanNum'):
+                found[(projectId, scanNum)] = scanId
+        return found
+
+    scans = existing()
+    # raw files can turn up in a later batch than the scan's first files
+    rawIds = [scans[key] for key in raw if key in scans]
+    if rawIds:
+        Scan.objects.filter(id__in=rawIds, cycspec=False).update(cycspec=True)
+    new = [Scan(projectId=df.projectId, scanNum=df.scanNum, startTime=df.startTime, duration=0,
+                backend='VEGAS', receiver='', mode='', source=df.source,
+                cycspec=key in raw)
+           for key, df in wanted.items() if key not in scans]
+    if new:
+        Scan.objects.bulk_create(new)
+        scans = existing()
+    return scans
+
+def ingestFiles(dataDir, paths, batchSize=None):
+    "Upsert Scans and Files for these paths in the data dir; returns how many Files are new"
+    batchSize = batchSize or INGEST_BATCH_SIZE
+    dataFiles = [df for df in (parseDataPath(dataDir, p) for p in paths) if df is not None]
+    banks = dict(Bank.objects.values_list('name', 'id'))
+    created = 0
+    for i in range(0, len(dataFiles), batchSize):
+        batch = dataFiles[i:i + batchSize]
+        unknownBanks = set([df.bankName for df in batch if df.bankName not in banks])
+        if unknownBanks:
+            logging.error("Skipping files for unknown banks: %s" % sorted(unknownBanks))
+            batch = [df for df in batch if df.bankName in banks]
+        with transaction.atomic():
+            scans = getScans(batch)
+            scanIds = set(scans.values())
+            before = File.objects.filter(scan_id__in=scanIds).count()
+            File.objects.bulk_create([
+                File(scan_id=scans[(df.projectId, df.scanNum)], bank_id=banks[df.bankName],
+                     filename=df.filename, baseDir=dataDir, deviceDir=df.deviceDir,
+                     fileType=df.fileType, creationTime=df.mtime, size=df.size, fileNum=df.fileNum)
+                for df in batch], ignore_conflicts=True)
+            Scan.banks.through.objects.bulk_create([
+                Scan.banks.through(scan_id=scanId, bank_id=bankId)
+                for scanId, bankId in set([(scans[(df.projectId, df.scanNum)], banks[df.bankName]) for df in batch])
+            ], ignore_conflicts=True)
+            created += File.objects.filter(scan_id__in=scanIds).count() - before
+            # ignore_conflicts means we don't get the new ids, so
+            # File.objects.bulk_create can't tell which scans changed
+            ScanSummary.scheduleRefresh(scanIds)
+    return created
+
+class PollingWatcher:
+    """
+    Finds new files by walking the data dir, only listing the bank dirs
+    modified since the last walk, and the ones that had files still
+    being written, and only returning files that have settled.
+    Works on NFS, where inotify doesn't see other hosts' writes.
+    """
+
+    def __init__(self, dataDir, interval=None, settle=None):
+        self.dataDir = dataDir
+        self.interval = interval or INGEST_INTERVAL
+        self.settle = INGEST_SETTLE_SECONDS if settle is None else settle
+        # files modified before this have been returned; 0 for the first walk
+        self.cursor = 0
+        # bank dirs that had unsettled files last time
+        self.active = set()
+        self.lastWalk = None
+
+    @staticmethod
+    def subDirs(path):
+        try:
+            with os.scandir(path) as entries:
+                return [e for e in entries if e.is_dir()]
+        except OSError as e:
+            logging.error("Could not list %s: %s" % (path, e))
+            return []
+
+    def bankDirs(self):
+        "project/deviceDir/bank dirs in the data dir"
+        dirs = self.subDirs(self.dataDir)
+        for _ in range(LAYOUT_DEPTH - 1):
+            dirs = [d for parent in dirs for d in self.subDirs(parent.path)]
+        return dirs
+
+    def walk(self):
+        "Paths of the files that have settled since the last walk"
+        upTo = time.time() - self.settle
+        # a second of slack for coarse mtimes; repeats are ignored on insert
+        since = self.cursor - 1
+        found = []
+        active = set()
+        for bankDir in self.bankDirs():
+            if bankDir.stat().st_mtime < since and bankDir.path not in self.active:
+                # nothing new in here
+                continue
+            try:
+                with os.scandir(bankDir.path) as entries:
+                    for e in entries:
+                        if not e.is_file():
+                            continue
+                        mtime = e.stat().st_mtime
+                        if mtime >= upTo:
+                            active.add(bankDir.path)
+                        elif mtime >= since:
+                            found.append(e.path)
+            except OSError as e:
+                logging.error("Could not list %s: %s" % (bankDir.path, e))
+                active.add(bankDir.path)
+        self.cursor = upTo
+        self.active = active
+        return found
+
+    def newFiles(self):
+        "Wait until it's time for the next walk, then walk"
+        if self.lastWalk is not None:
+            time.sleep(max(0, self.interval - (time.monotonic() - self.lastWalk)))
+        self.lastWalk = time.monotonic()
+        return self.walk()
+
+class InotifyWatcher:
+    """
+    Finds new files with inotify: a watch on every directory down to the
+    bank dirs, and a file is new once it's closed after writing (or moved
+    into place).  Starts with a walk of what's already there, and walks
+    again if events are lost because the kernel's queue overflowed.
+    """
+
+    # events for files in the bank dirs, and for new dirs above them
+    FILE_EVENTS = None if INotify is None else flags.CLOSE_WRITE | flags.MOVED_TO
+    DIR_EVENTS = None if INotify is None else flags.CREATE | flags.MOVED_TO
+
+    def __init__(self, dataDir, interval=None):
+        self.dataDir = dataDir
+        self.interval = interval or INGEST_INTERVAL
+        self.inotify = INotify()
+        # watch descriptor -> (path, depth below the data dir)
+        self.watches = {}
+        # when we last started reading events; lost ones came after this
+        self.lastRead = time.time()
+        self.overflows = 0
+        self.pending = self.addTree(dataDir, 0)
+
+    def addTree(self, path, depth):
+        "Watch path and the dirs below it; returns the files already there"
+        events = self.FILE_EVENTS if depth == LAYOUT_DEPTH else self.DIR_EVENTS
+        try:
+            wd = self.inotify.add_watch(path, events)
+        except OSError as e:
+            logging.error("Could not watch %s: %s" % (path, e))
+            return []
+        self.watches[wd] = (path, depth)
+        return self.scanDir(path, depth)
+
+    def scanDir(self, path, depth, since=None):
+        "Files in a bank dir (changed since 'since'), or those in dirs below path we're not watching yet"
+        found = []
+        watched = set([p for p, d in self.watches.values()])
+        try:
+            with os.scandir(path) as entries:
+                for e in entries:
+                    if depth == LAYOUT_DEPTH and e.is_file():
+                        # a rename changes ctime, where it keeps mtime
+                        if since is None or e.stat().st_ctime >= since:
+                            found.append(e.path)
+                    elif depth < LAYOUT_DEPTH and e.is_dir() and e.path not in watched:
+                        # all of it: moving a dir in doesn't change it's files' ctimes
+                        found.extend(self.addTree(e.path, depth + 1))
+        except OSError as e:
+            logging.error("Could not list %s: %s" % (path, e))
+        return found
+
+    def rescan(self, since):
+        "After an overflow: files changed since 'since', and dirs whose creation we missed"
+        self.overflows += 1
+        logging.error("inotify queue overflowed; looking for files changed since %s" % since)
+        found = []
+        for path, depth in list(self.watches.values()):
+            found.extend(self.scanDir(path, depth, since))
+        return found
+
+    def newFiles(self):
+        "Files finished since the last call, waiting up to interval for some"
+        found, self.pending = self.pending, []
+        if found:
+            return found
+        # a second of slack for coarse timestamps; repeats are ignored on insert
+        since, self.lastRead = self.lastRead - 1, time.time()
+        overflowed = False
+        for event in self.inotify.read(timeout=int(1000 * self.interval)):
+            if event.mask & flags.Q_OVERFLOW:
+                overflowed = True
+                continue
+            if event.mask & flags.IGNORED:
+                # the dir was deleted (or unmounted), and it's watch with it
+                self.watches.pop(event.wd, None)
+                continue
+            if event.wd not in self.watches:
+                continue
+            parent, depth = self.watches[event.wd]
+            path = os.path.join(parent, event.name)
+            if event.mask & flags.ISDIR:
+                if depth < LAYOUT_DEPTH:
+                    # anything written before the watch was added
+                    found.extend(self.addTree(path, depth + 1))
+            elif depth == LAYOUT_DEPTH:
+                found.append(path)
+        if overflowed:
+            found.extend(self.rescan(since))
+        return found
+
+def getWatcher(dataDir, poll=False, interval=None):
+    "An InotifyWatcher if we can, otherwise a PollingWatcher"
+    if not poll and INotify is not None:
+        return InotifyWatcher(dataDir, interval=interval)
+    if not poll:
+        logging.info("inotify_simple is not installed; polling %s instead" % dataDir)
+    return PollingWatcher(dataDir, interval=interval)
@@ -0,0 +1,74 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .models import BackgroundJob, JOB_RUNNING, JOB_DONE, JOB_FAILED
+
+# how often (seconds) a running job's updated time is touched, so
+# job_progress can tell it from one whose process has died
+JOB_HEARTBEAT_INTERVAL = getattr(settings, 'JOB_HEARTBEAT_INTERVAL', 10)
+
+
+def startJob(kind, work, total, params=None):
+    "Create a BackgroundJob and run work(job) for it in a worker thread"
+    job = BackgroundJob.objects.create(kind=kind, total=total, params=params or {})
+    t = threading.Thread(target=runJob, args=(job.id, work), daemon=True,
+                         name="%s-%d" % (kind, job.id))
+    # the worker can't see the job until it's committed
+    transaction.on_commit(t.start)
+    return job
+
+def runJob(jobId, work):
+    "Thread target: work(job) returns the text to report when it's done"
+    job = BackgroundJob.objects.get(id=jobId)
+    stopped = threading.Event()
+    heart = threading.Thread(target=heartbeat, args=(jobId, stopped), daemon=True,
+                             name="%s-%d-heartbeat" % (job.kind, jobId))
+    try:
+        job.state = JOB_RUNNING
+        job.save()
+        heart.start()
+        job.result = work(job)
+        job.state = JOB_DONE
+    except Exception as e:
+        logging.exception("%s failed" % job)
+        job.state = JOB_FAILED
+        job.result = str(e)
+    finally:
+        stopped.set()
+        job.save()
+        # this thread has it's own DB connection
+        connection.close()
+
+def heartbeat(jobId, stopped):
+    "Touch the job's updated time every JOB_HEARTBEAT_INTERVAL until stopped"
+    try:
+        while not stopped.wait(JOB_HEARTBEAT_INTERVAL):
+            BackgroundJob.objects.filter(id=jobId, state=JOB_RUNNING).update(updated=timezone.now())
+    except Exception as e:
+        logging.error("Heartbeat of job %d failed: %s" % (jobId, e))
+    finally:
+        connection.close()
+
+def reportProgress(job, done):
+    "Cheap update the progress endpoint can poll"
+    job.done = done
+    BackgroundJob.objects.filter(id=job.id).update(done=done, updated=timezone.now())
+
+def updateInChunks(job, queryset, chunkSize=5000, **kwargs):
+    "queryset.update(**kwargs) one committed chunk of primary keys at a time"
+    model = queryset.model
+    done = lastPk = 0
+    while True:
+        pks = list(queryset.filter(pk__gt=lastPk).order_by('pk').values_list('pk', flat=True)[:chunkSize])
+        if not pks:
+            break
+        with transaction.atomic():
+            model.objects.filter(pk__in=pks).update(**kwargs)
+        done += len(pks)
+        lastPk = pks[-1]
+        reportProgress(job, done)
+    return done
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from mdb.heartbeats import flush
+
+
+class Command(BaseCommand):
+    help = "Write the heartbeats waiting in the heartbeat store to the DB now"
+
+    def handle(self, *args, **options):
+        n = flush()
+        self.stdout.write(self.style.SUCCESS("Flushed %d heartbeat rows" % n))
@@ -0,0 +1,46 @@
+import logging
+
+from django.core.management.base import BaseCommand, CommandError
+
+from mdb.ingest import INGEST_BATCH_SIZE, getWatcher, ingestFiles
+from utils import getDt, getVegasDataDirFromConfig
+
+
+class Command(BaseCommand):
+    help = "Watch the VEGAS data dir and add Scan and File rows for new data files"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--data-dir', help="default: VEGAS_DATA_DIR from cycspec.conf")
+        parser.add_argument('--interval', type=float,
+                            help="seconds between walks, or to wait for inotify events (default: INGEST_INTERVAL)")
+        parser.add_argument('--batch-size', type=int, default=INGEST_BATCH_SIZE,
+                            help="files per insert transaction")
+        parser.add_argument('--poll', action='store_true',
+                            help="walk the data dir even if inotify is available (e.g., it's on NFS)")
+        parser.add_argument('--once', action='store_true',
+                            help="ingest what's there now and exit")
+
+    def handle(self, *args, **options):
+        dataDir = options['data_dir'] or getVegasDataDirFromConfig()
+        watcher = getWatcher(dataDir, poll=options['poll'] or options['once'], interval=options['interval'])
+        if options['once']:
+            # everything that's there, settled or not
+            watcher.settle = 0
+        self.stdout.write("Ingesting files from %s with %s" % (dataDir, type(watcher).__name__))
+        # the watcher won't return these again, so hang on to them until
+        # they're in (files already ingested are ignored the second time)
+        failed = []
+        while True:
+            paths = list(dict.fromkeys(failed + watcher.newFiles()))
+            failed = []
+            if paths:
+                try:
+                    n = ingestFiles(dataDir, paths, batchSize=options['batch_size'])
+                    self.stdout.write("%s: %d new files of %d found" % (getDt(), n, len(paths)))
+                except Exception:
+                    logging.exception("ingest of %d files failed, will retry" % len(paths))
+                    failed = paths
+            if options['once']:
+                if failed:
+                    raise CommandError("ingest of %d files failed" % len(failed))
+                break
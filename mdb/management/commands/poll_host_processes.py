@@ -0,0 +1,66 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from mdb.models import BANKNAMES, PROCESSED_STARTED, HostProcessSnapshot, Processing
+from utils import PROBE_UNKNOWN, getBankHost, getDt, probeExecutor, probeHost
+
+
+def pollOnce():
+    "Probe every bank host once and save what we found as HostProcessSnapshots"
+    banksByHost = {}
+    for b in BANKNAMES:
+        banksByHost.setdefault(getBankHost(b), []).append(b)
+    hosts = sorted(banksByHost)
+    # the pids of the processing we think is going on
+    pidsByHost = {}
+    started = Processing.objects.filter(processedState=PROCESSED_STARTED, pid__isnull=False)
+    for bankName, pid in started.values_list('bank__name', 'pid'):
+        if bankName in BANKNAMES:
+            pidsByHost.setdefault(getBankHost(bankName), []).append(pid)
+
+    results = probeExecutor.map(lambda host: probeHost(host, pidsByHost.get(host)), hosts)
+
+    now = getDt()
+    snapshots = []
+    for host, result in zip(hosts, results):
+        snap = HostProcessSnapshot(host=host, banks=banksByHost[host], sampleTime=now)
+        if result == PROBE_UNKNOWN:
+            snap.error = "unreachable, or timed out"
+        else:
+            snap.reachable = True
+            snap.dspsrPids = result['dspsrPids']
+            snap.checkedPids = result['checkedPids']
+            snap.runningPids = result['runningPids']
+            snap.latency = result['latency']
+        snapshots.append(snap)
+    fields = [f.name for f in HostProcessSnapshot._meta.concrete_fields if f.name not in ('id', 'host')]
+    HostProcessSnapshot.objects.bulk_create(snapshots, update_conflicts=True,
+                                            unique_fields=['host'], update_fields=fields)
+    return snapshots
+
+
+class Command(BaseCommand):
+    help = "Snapshot dspsr and Processing pids on every bank host at a fixed cadence"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=10.0,
+                            help="seconds between the start of each poll")
+        parser.add_argument('--once', action='store_true',
+                            help="poll once and exit")
+
+    def handle(self, *args, **options):
+        interval = options['interval']
+        while True:
+            start = time.monotonic()
+            try:
+                snapshots = pollOnce()
+                self.stdout.write("%s: polled %d hosts, %d unreachable" % (
+                    getDt(), len(snapshots), len([s for s in snapshots if not s.reachable])))
+            except Exception:
+                # keep polling; the snapshots will just go stale
+                logging.exception("poll of bank hosts failed")
+            if options['once']:
+                break
+            time.sleep(max(0, interval - (time.monotonic() - start)))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from mdb.models import ScanSummary
+
+
+class Command(BaseCommand):
+    help = "Recompute every ScanSummary from the File, Processing and QualityCheck tables"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500,
+                            help="number of scans to summarize per batch of queries")
+
+    def handle(self, *args, **options):
+        n = ScanSummary.rebuild(chunkSize=options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS("Rebuilt summaries for %d scans" % n))
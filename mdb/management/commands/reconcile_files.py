@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from mdb.models import File
+from mdb.reconcile import reconcileFiles
+
+
+class Command(BaseCommand):
+    help = "Check File rows against the disk, and fix their deleted flags and sizes"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--project', help="only this project's files")
+        parser.add_argument('--scan', type=int, help="only this scan number's files (use with --project)")
+        parser.add_argument('--bank', help="only this bank's files")
+        parser.add_argument('--workers', type=int,
+                            help="number of directories to list at once (default: RECONCILE_WORKERS)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="report what's out of date, but don't change the DB")
+
+    def handle(self, *args, **options):
+        files = File.objects.all()
+        if options['project']:
+            files = files.filter(scan__projectId=options['project'])
+        if options['scan'] is not None:
+            files = files.filter(scan__scanNum=options['scan'])
+        if options['bank']:
+            files = files.filter(bank__name=options['bank'])
+
+        r = reconcileFiles(files, workers=options['workers'], dryRun=options['dry_run'])
+
+        self.stdout.write("Checked %d files in %d directories in %.1f seconds" % (
+            r['files'], r['directories'], r['seconds']))
+        for dirPath in r['missingDirectories']:
+            self.stdout.write("  missing directory: %s" % dirPath)
+        for dirPath, error in r['unreadableDirectories']:
+            self.stdout.write(self.style.WARNING("  could not list %s (%s); skipped it's files" % (dirPath, error)))
+        self.stdout.write("%s %d files deleted, %d files not deleted, and %s %d sizes" % (
+            "Would mark" if r['dryRun'] else "Marked", len(r['nowDeleted']), len(r['nowPresent']),
+            "would update" if r['dryRun'] else "updated", len(r['sizeChanged'])))
+        if options['verbosity'] > 1:
+            for label, ids in [('deleted', r['nowDeleted']), ('not deleted', r['nowPresent']),
+                               ('size changed', list(r['sizeChanged']))]:
+                for f in File.objects.filter(id__in=ids).select_related('scan', 'bank'):
+                    self.stdout.write("  %s: %s" % (label, f.getFullPath()))
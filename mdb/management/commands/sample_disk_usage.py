@@ -0,0 +1,30 @@
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from utils import diskUsageSampler, getDt
+
+
+class Command(BaseCommand):
+    help = "Sample the usage of the mounts in cycspec.conf at a fixed cadence, for their fill rates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float,
+                            help="seconds between the start of each sample (default: DISK_USAGE_TTL)")
+        parser.add_argument('--once', action='store_true',
+                            help="sample once and exit")
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or diskUsageSampler.ttl
+        while True:
+            start = time.monotonic()
+            try:
+                usage = diskUsageSampler.sampleMounts(maxAge=0)
+                self.stdout.write("%s: sampled %d mounts, %d unavailable" % (
+                    getDt(), len(usage), len([u for u in usage.values() if u is None])))
+            except Exception:
+                logging.exception("sample of disk usage failed")
+            if options['once']:
+                break
+            time.sleep(max(0, interval - (time.monotonic() - start)))
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-17 14:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mdb', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='processing',
+            name='processedState',
+            field=models.CharField(choices=[('COMPLETED', 'COMPLETED'), ('NOT_STARTED', 'NOT_STARTED'), ('STARTED', 'STARTED'), ('ABORTED', 'ABORTED'), ('FAILED', 'FAILED')], default='NOT_STARTED', max_length=256),
+        ),
+        migrations.CreateModel(
+            name='ScanSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fileCount', models.IntegerField(default=0)),
+                ('rawFileCount', models.IntegerField(default=0)),
+                ('deletedFileCount', models.IntegerField(default=0)),
+                ('liveBytes', models.BigIntegerField(default=0)),
+                ('liveRawBytes', models.BigIntegerField(default=0)),
+                ('deletedBytes', models.BigIntegerField(default=0)),
+                ('bankStates', models.JSONField(default=dict)),
+                ('worstProcessedState', models.CharField(choices=[('COMPLETED', 'COMPLETED'), ('NOT_STARTED', 'NOT_STARTED'), ('STARTED', 'STARTED'), ('ABORTED', 'ABORTED'), ('FAILED', 'FAILED')], default='NOT_STARTED', max_length=256)),
+                ('qualityCheckCount', models.IntegerField(default=0)),
+                ('updated', models.DateTimeField(auto_now=True, verbose_name='last refreshed')),
+                ('scan', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='summary', to='mdb.scan')),
+            ],
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-17 14:16
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_processing(apps, schema_editor):
+    "Refuse to add the unique constraint if it would fail, and say where"
+    Processing = apps.get_model('mdb', 'Processing')
+    dups = (Processing.objects.values('scan', 'bank', 'processingType')
+            .annotate(n=Count('id')).filter(n__gt=1))
+    if dups.exists():
+        raise RuntimeError("Duplicate Processing rows for (scan, bank, processingType); "
+                           "resolve these before migrating: %s" % list(dups[:20]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mdb', '0002_scansummary'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['scan', 'fileType', 'bank', 'creationTime'], name='file_scan_type_bank_ctime_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['projectId', 'scanNum'], name='scan_project_scannum_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='scan',
+            index=models.Index(fields=['startTime', 'id'], name='scan_starttime_id_idx'),
+        ),
+        migrations.RunPython(check_duplicate_processing, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='processing',
+            constraint=models.UniqueConstraint(fields=('scan', 'bank', 'processingType'), name='unique_processing_per_scan_bank_type'),
+        ),
+    ]
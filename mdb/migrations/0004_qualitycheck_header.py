@@ -0,0 +1,84 @@
+# Generated by Django 4.2.30 on 2026-10-17 14:19
+
+import ast
+import json
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+# frozen copies of mdb.models' QC_INDEXED_HEADER_KEYS, parseHeaderStr
+# and indexedHeaderValues as they were when this migration was written
+QC_INDEXED_HEADER_KEYS = ['OBSFREQ', 'NCHAN', 'BLOCSIZE']
+
+
+def parseHeaderStr(headerStr):
+    if headerStr is None:
+        return None
+    try:
+        hdr = ast.literal_eval(headerStr)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        return None
+    if not isinstance(hdr, dict):
+        return None
+    return json.loads(json.dumps(hdr, default=str))
+
+
+def indexedHeaderValues(hdr):
+    hdr = hdr or {}
+    for key in QC_INDEXED_HEADER_KEYS:
+        if key not in hdr:
+            continue
+        value = hdr[key]
+        try:
+            numValue = float(value)
+        except (TypeError, ValueError):
+            numValue = None
+        yield key, str(value)[:256], numValue
+
+
+def parse_headers(apps, schema_editor):
+    "Parse the existing headerStr values once, instead of on every access"
+    QualityCheck = apps.get_model('mdb', 'QualityCheck')
+    QualityCheckHeader = apps.get_model('mdb', 'QualityCheckHeader')
+    lastId = 0
+    while True:
+        qcs = list(QualityCheck.objects.filter(id__gt=lastId).order_by('id').only('id', 'headerStr')[:2000])
+        if not qcs:
+            break
+        for qc in qcs:
+            qc.header = parseHeaderStr(qc.headerStr)
+        QualityCheck.objects.bulk_update(qcs, ['header'])
+        QualityCheckHeader.objects.bulk_create([
+            QualityCheckHeader(qualityCheck_id=qc.id, key=k, value=v, numValue=n)
+            for qc in qcs for k, v, n in indexedHeaderValues(qc.header)])
+        lastId = qcs[-1].id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mdb', '0003_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='qualitycheck',
+            name='header',
+            field=models.JSONField(null=True),
+        ),
+        migrations.CreateModel(
+            name='QualityCheckHeader',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('value', models.CharField(max_length=256)),
+                ('numValue', models.FloatField(null=True)),
+                ('qualityCheck', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='headerValues', to='mdb.qualitycheck')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['key', 'value'], name='qcheader_key_value_idx'), models.Index(fields=['key', 'numValue'], name='qcheader_key_numvalue_idx')],
+            },
+        ),
+        migrations.RunPython(parse_headers, migrations.RunPython.noop),
+    ]
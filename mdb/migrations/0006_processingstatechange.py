@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-17 14:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mdb', '0005_backgroundjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProcessingStateChange',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('oldState', models.CharField(choices=[('COMPLETED', 'COMPLETED'), ('NOT_STARTED', 'NOT_STARTED'), ('STARTED', 'STARTED'), ('ABORTED', 'ABORTED'), ('FAILED', 'FAILED')], max_length=256)),
+                ('newState', models.CharField(choices=[('COMPLETED', 'COMPLETED'), ('NOT_STARTED', 'NOT_STARTED'), ('STARTED', 'STARTED'), ('ABORTED', 'ABORTED'), ('FAILED', 'FAILED')], max_length=256)),
+                ('changeTime', models.DateTimeField(verbose_name='change time')),
+                ('processing', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stateChanges', to='mdb.processing')),
+            ],
+        ),
+    ]
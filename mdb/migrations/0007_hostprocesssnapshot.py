@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-17 14:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mdb', '0006_processingstatechange'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HostProcessSnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('host', models.CharField(max_length=256, unique=True)),
+                ('banks', models.JSONField(default=list)),
+                ('reachable', models.BooleanField(default=False)),
+                ('dspsrPids', models.JSONField(default=list)),
+                ('checkedPids', models.JSONField(default=list)),
+                ('runningPids', models.JSONField(default=list)),
+                ('latency', models.FloatField(null=True)),
+                ('error', models.TextField(null=True)),
+                ('sampleTime', models.DateTimeField(verbose_name='sample time')),
+            ],
+        ),
+    ]
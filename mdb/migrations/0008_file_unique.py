@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-17 14:33
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_files(apps, schema_editor):
+    "Refuse to add the unique constraint if it would fail, and say where"
+    File = apps.get_model('mdb', 'File')
+    dups = (File.objects.values('scan', 'bank', 'filename')
+            .annotate(n=Count('id')).filter(n__gt=1))
+    if dups.exists():
+        raise RuntimeError("Duplicate File rows for (scan, bank, filename); "
+                           "resolve these before migrating: %s" % list(dups[:20]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mdb', '0007_hostprocesssnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_files, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='file',
+            constraint=models.UniqueConstraint(fields=('scan', 'bank', 'filename'), name='unique_file_per_scan_bank'),
+        ),
+    ]
@@ -1,9 +1,17 @@
+import ast
+import json
+import logging
 import os
 
+from django.conf import settings
 from django.core.files.storage import FileSystemStorage
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, Exists, IntegerField, Max, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from utils import isPidRunning, formatDt, getDt, getInternalMount
+from utils import arePidsRunning, isPidRunning, formatDt, getDt, getInternalMount, BANKNAMES
+from .heartbeats import getHeartbeat, PROCESSING, QUALITY_CHECK, STATUS
 
 
 qualityCheckStorage = FileSystemStorage(location='/users/pmargani/tmp/qualityChecks')
@@ -30,8 +38,23 @@ PROCESSED_STATES = [
 
 PROCESSED_STATES_CHOICES = [(s, s) for s in PROCESSED_STATES]
 
-NUMBANKS = 3*8
-BANKNAMES = [chr(ord('A')+i) for i in range(NUMBANKS)]
+# String constants for the BackgroundJob.state field
+JOB_PENDING = 'PENDING'
+JOB_RUNNING = 'RUNNING'
+JOB_DONE = 'DONE'
+JOB_FAILED = 'FAILED'
+
+JOB_STATES_CHOICES = [(s, s) for s in [JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED]]
+
+# an unfinished BackgroundJob whose worker hasn't touched it for this
+# many seconds is assumed to have died with it's process
+JOB_STALE_SECONDS = getattr(settings, 'JOB_STALE_SECONDS', 60)
+
+# HostProcessSnapshots older than this (seconds) are ignored
+HOST_SNAPSHOT_MAX_AGE = getattr(settings, 'HOST_SNAPSHOT_MAX_AGE', 60)
+
+# QualityCheck header keys we copy into QualityCheckHeader so we can search on them
+QC_INDEXED_HEADER_KEYS = ['OBSFREQ', 'NCHAN', 'BLOCSIZE']
 
 # Create your models here.
 class Bank(models.Model):
@@ -50,6 +73,145 @@ class Bank(models.Model):
             print("bank %s created? %s" % (b, created))
 
 
+def processedStateRank(field='processedState'):
+    "SQL expression for the index of the given state field in PROCESSED_STATES"
+    return Case(*[When(**{field: state}, then=Value(i)) for i, state in enumerate(PROCESSED_STATES)],
+                output_field=IntegerField())
+
+def processedStateFromRank(rank):
+    "SQL expression turning a PROCESSED_STATES index back into the state string"
+    return Case(*[When(**{rank: i}, then=Value(state)) for i, state in enumerate(PROCESSED_STATES)],
+                default=Value(PROCESSED_NOT_STARTED),
+                output_field=models.CharField())
+
+class SummarizedQuerySet(models.QuerySet):
+    """
+    Bulk operations skip the save/delete signals that keep ScanSummary
+    up to date, so refresh the summaries of the affected scans here.
+    'scanField' is the lookup from this model to it's Scan.
+    """
+    scanField = 'scan'
+
+    def scanIds(self):
+        return set(self.order_by().values_list(self.scanField, flat=True).distinct())
+
+    def scanIdsOf(self, pks, chunkSize=500):
+        "scanIds() of the rows with these primary keys"
+        scanIds = set()
+        for i in range(0, len(pks), chunkSize):
+            scanIds |= self.model.objects.filter(pk__in=pks[i:i + chunkSize]).scanIds()
+        return scanIds
+
+    def movesScans(self, fields):
+        "Would writing these fields move rows to another scan?"
+        field = self.scanField.split('__')[0]
+        return field in fields or field + '_id' in fields
+
+    def update(self, **kwargs):
+        scanIds = self.scanIds()
+        # the rows' new scans need refreshing too
+        pks = list(self.order_by().values_list('pk', flat=True)) if self.movesScans(kwargs) else []
+        n = super().update(**kwargs)
+        ScanSummary.scheduleRefresh(scanIds | self.scanIdsOf(pks))
+        return n
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super().bulk_create(objs, *args, **kwargs)
+        ScanSummary.scheduleRefresh(self.scanIdsOf([o.pk for o in objs if o.pk is not None]))
+        return objs
+
+    def bulk_update(self, objs, *args, **kwargs):
+        objs = list(objs)
+        n = super().bulk_update(objs, *args, **kwargs)
+        ScanSummary.scheduleRefresh(self.scanIdsOf([o.pk for o in objs]))
+        return n
+
+class FileQuerySet(SummarizedQuerySet):
+
+    def summarize(self):
+        "Count these files and find their projects, scans and banks in one grouped query"
+        groups = self.order_by().values('scan__projectId', 'scan__scanNum', 'bank__name').annotate(n=Count('id'))
+        summary = dict(count=0, projects=set(), scans=set(), banks=set())
+        for g in groups:
+            summary['count'] += g['n']
+            summary['projects'].add(g['scan__projectId'])
+            summary['scans'].add(g['scan__scanNum'])
+            summary['banks'].add(g['bank__name'])
+        return summary
+
+    def resolve_paths(self, qs=None, internal=False, chunkSize=2000):
+        """
+        Yields (file id, path) for these files (or qs), as getFullPath, or
+        getInternalPath if internal, would give, but from one streamed
+        query for just the columns needed, with project and bank joined in.
+        """
+        qs = self if qs is None else qs
+        internalDir = File.getInternalBaseDir() if internal else None
+        rows = qs.values_list('id', 'baseDir', 'scan__projectId', 'deviceDir', 'bank__name', 'filename')
+        for fileId, baseDir, proj, deviceDir, bankName, filename in rows.iterator(chunk_size=chunkSize):
+            yield fileId, File.buildPath(internalDir or baseDir, proj, deviceDir, bankName, filename)
+
+class ScanQuerySet(models.QuerySet):
+
+    def with_file_stats(self):
+        "Annotate each scan with fileCount, totalBytes and deletedFileCount"
+        # use correlated subqueries rather than joins so the File
+        # and Processing annotations don't multiply each other
+        files = File.objects.filter(scan=OuterRef('pk')).order_by().values('scan')
+        return self.annotate(
+            fileCount=Coalesce(Subquery(files.annotate(n=Count('id')).values('n')), 0),
+            totalBytes=Coalesce(Subquery(files.annotate(n=Sum('size')).values('n')), 0),
+            deletedFileCount=Coalesce(Subquery(files.filter(deleted=True).annotate(n=Count('id')).values('n')), 0),
+        )
+
+    def with_processed_state(self):
+        "Annotate each scan with the worst processedState of all it's banks"
+        ps = Processing.objects.filter(scan=OuterRef('pk')).order_by().values('scan')
+        worst = ps.annotate(rank=Max(processedStateRank())).values('rank')
+        # no processing objects counts as not started, as in Scan.processedState
+        notStarted = PROCESSED_STATES.index(PROCESSED_NOT_STARTED)
+        return self.annotate(worstProcessedRank=Coalesce(Subquery(worst), notStarted)).annotate(
+            worstProcessedState=processedStateFromRank('worstProcessedRank'),
+            allProcessed=Q(worstProcessedRank=PROCESSED_STATES.index(PROCESSED_COMPLETED)))
+
+    def with_deletion_status(self):
+        "Annotate allFilesDeleted and allRawFilesDeleted, like Scan.isDeleted and isCycSpecDeleted"
+        live = File.objects.filter(scan=OuterRef('pk'), deleted=False)
+        return self.annotate(
+            allFilesDeleted=~Exists(live),
+            allRawFilesDeleted=~Exists(live.filter(fileType='raw')),
+        )
+
+    def in_processed_state(self, *states):
+        "Scans whose worst processing state is one of the given ones"
+        qs = self if 'worstProcessedState' in self.query.annotations else self.with_processed_state()
+        return qs.filter(worstProcessedState__in=states)
+
+    def processed(self):
+        "Scans where the processing of every bank was successful"
+        return self.in_processed_state(PROCESSED_COMPLETED)
+
+    def with_live_files(self, raw=False):
+        "Scans that still have files (or just raw files) on disk"
+        live = File.objects.filter(scan=OuterRef('pk'), deleted=False)
+        if raw:
+            live = live.filter(fileType='raw')
+        return self.filter(Exists(live))
+
+    def seek(self, after=None, before=None):
+        """
+        Keyset pagination on (startTime, id).
+        'after' and 'before' are the (startTime, id) of the last or first
+        scan of the current page.  A 'before' page comes back in
+        descending order, so the caller has to reverse it.
+        """
+        if after is not None:
+            startTime, pk = after
+            return self.filter(Q(startTime__gt=startTime) | Q(startTime=startTime, id__gt=pk)).order_by('startTime', 'id')
+        if before is not None:
+            startTime, pk = before
+            return self.filter(Q(startTime__lt=startTime) | Q(startTime=startTime, id__lt=pk)).order_by('-startTime', '-id')
+        return self.order_by('startTime', 'id')
 
 class Scan(models.Model):
     scanNum = models.IntegerField()
@@ -64,26 +226,37 @@ class Scan(models.Model):
     cycspec = models.BooleanField(default=False)
     banks = models.ManyToManyField(Bank)
 
+    objects = ScanQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # the forms look scans up by project and scan number
+            models.Index(fields=['projectId', 'scanNum'], name='scan_project_scannum_idx'),
+            # keyset pagination of the scan list
+            models.Index(fields=['startTime', 'id'], name='scan_starttime_id_idx'),
+        ]
+
     def __str__(self):
         return "Scan %d, Project: %s, Start: %s, # Files: %d" % (self.scanNum,
                 self.projectId,
                 self.startTime,
-                self.file_set.count())
+                self.numFiles())
+
+    def numFiles(self):
+        "Use the fileCount annotation if we've got it, otherwise ask the DB"
+        if hasattr(self, 'fileCount'):
+            return self.fileCount
+        return self.file_set.count()
 
     def processedState(self):
         "Try to represent the states of all the banks' processed data"
-        p = set([p.processedState for p in self.processing_set.all()])
-        if len(p) == 0:
-            # actually unknown!
-            return PROCESSED_NOT_STARTED
-        elif len(p) == 1:
-            # easy: all banks have the same state
-            return list(p)[0]
-        else:
-            # more complicated.  return the 'worst' state
-            p = list(p)
-            idx = max([PROCESSED_STATES.index(s) for s in p])
-            return PROCESSED_STATES[idx]
+        # ScanQuerySet.with_processed_state already did this for us
+        if hasattr(self, 'worstProcessedState'):
+            return self.worstProcessedState
+        # otherwise, the 'worst' state is the highest ranked one;
+        # no processing objects means it's actually unknown!
+        rank = self.processing_set.aggregate(rank=Max(processedStateRank()))['rank']
+        return PROCESSED_NOT_STARTED if rank is None else PROCESSED_STATES[rank]
 
     def getBankProcessedState(self, bankName):
         ps = self.processing_set.filter(bank__name=bankName)
@@ -106,15 +279,21 @@ class Scan(models.Model):
 
     def isProcessed(self):
         "short hand for seeing if the processing was successful"
+        if hasattr(self, 'allProcessed'):
+            return self.allProcessed
         return self.processedState() == PROCESSED_COMPLETED
 
     def isDeleted(self):
         "We consider it deleted if ALL it's files have been deleted"
-        return len([f for f in self.file_set.all() if f.deleted == False]) == 0
+        if hasattr(self, 'allFilesDeleted'):
+            return self.allFilesDeleted
+        return not self.file_set.filter(deleted=False).exists()
 
     def isCycSpecDeleted(self):
         "We consider it deleted if all it's raw files have been deleted"
-        return len([f for f in self.file_set.all() if f.deleted == False and f.isCycSpec()]) == 0
+        if hasattr(self, 'allRawFilesDeleted'):
+            return self.allRawFilesDeleted
+        return not self.file_set.filter(deleted=False, fileType='raw').exists()
 
     def bankNames(self):
         "returns A,B if those are the two banks"
@@ -149,6 +328,18 @@ class File(models.Model):
     done = models.BooleanField(default=False)
     deleted = models.BooleanField(default=False)
 
+    objects = FileQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Scan.getCycspecFiles
+            models.Index(fields=['scan', 'fileType', 'bank', 'creationTime'], name='file_scan_type_bank_ctime_idx'),
+        ]
+        constraints = [
+            # so ingest can bulk_create with ignore_conflicts
+            models.UniqueConstraint(fields=['scan', 'bank', 'filename'], name='unique_file_per_scan_bank'),
+        ]
+
     def isCycSpec(self):
         "The raw file extension presumes this is for cyclic spectroscopy"
         return self.fileType == 'raw'
@@ -157,18 +348,26 @@ class File(models.Model):
         "Does this file still leave where it says it does?"
         return os.path.isfile(self.getFullPath())
 
+    @staticmethod
+    def buildPath(baseDir, proj, deviceDir, bankName, filename):
+        "baseDir/project/deviceDir/bank/filename"
+        return os.path.join(baseDir, proj or "", deviceDir, bankName or "", filename)
+
+    @staticmethod
+    def getInternalBaseDir():
+        return os.path.join(getInternalMount(), "scratch")
+
     def getFullPath(self):
         "Join attributes together to get an absolute path"
         bankName = self.bank.name if self.bank is not None else ''
         proj = self.scan.projectId if self.scan is not None else ""
-        return os.path.join(self.baseDir, proj, self.deviceDir, bankName, self.filename)
+        return self.buildPath(self.baseDir, proj, self.deviceDir, bankName, self.filename)
 
     def getInternalPath(self):
         "How to find this file on the interal drive?"
         bankName = self.bank.name if self.bank is not None else ''
         proj = self.scan.projectId if self.scan is not None else ""
-        baseDir = os.path.join(getInternalMount(), "scratch")
-        return os.path.join(baseDir, proj, self.deviceDir, bankName, self.filename)
+        return self.buildPath(self.getInternalBaseDir(), proj, self.deviceDir, bankName, self.filename)
 
     def getCreationTimeStr(self):
         return formatDt(self.creationTime)
@@ -177,6 +376,83 @@ class File(models.Model):
         scanNum = self.scan.scanNum if self.scan is not None else -1
         return "File for scan %d: %s" % (scanNum, self.filename)
 
+def parseHeaderStr(headerStr):
+    "The header is stored as the repr of a dict; safely turn it back into one"
+    if headerStr is None:
+        return None
+    try:
+        hdr = ast.literal_eval(headerStr)
+    except (ValueError, SyntaxError, MemoryError, RecursionError):
+        logging.error("Could not evaluate header as dictionary")
+        return None
+    if not isinstance(hdr, dict):
+        logging.error("Header is not a dictionary")
+        return None
+    # make sure it survives the trip into a JSONField
+    return json.loads(json.dumps(hdr, default=str))
+
+def indexedHeaderValues(hdr):
+    "(key, value, numerical value or None) for the QC_INDEXED_HEADER_KEYS in this header"
+    hdr = hdr or {}
+    for key in QC_INDEXED_HEADER_KEYS:
+        if key not in hdr:
+            continue
+        value = hdr[key]
+        try:
+            numValue = float(value)
+        except (TypeError, ValueError):
+            numValue = None
+        yield key, str(value)[:256], numValue
+
+class QualityCheckQuerySet(SummarizedQuerySet):
+    """
+    Keeps header and QualityCheckHeader in sync with headerStr when it's
+    written in bulk, as QualityCheck.save() does for single QCs
+    """
+    scanField = 'file__scan'
+
+    def update(self, **kwargs):
+        # with header too, it's bulk_update, which has parsed them already
+        if 'headerStr' not in kwargs or 'header' in kwargs:
+            return super().update(**kwargs)
+        if not isinstance(kwargs['headerStr'], str):
+            raise ValueError("headerStr can only be updated to a string, so it can be parsed")
+        header = parseHeaderStr(kwargs['headerStr'])
+        kwargs['header'] = header
+        with transaction.atomic(using=self.db):
+            ids = list(self.order_by().values_list('pk', flat=True))
+            n = super().update(**kwargs)
+            QualityCheckHeader.index([QualityCheck(pk=pk, header=header) for pk in ids])
+        return n
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for qc in objs:
+            qc.parseHeader()
+        objs = super().bulk_create(objs, *args, **kwargs)
+        QualityCheckHeader.index([qc for qc in objs if qc.pk is not None])
+        return objs
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        if 'headerStr' not in fields:
+            return super().bulk_update(objs, fields, *args, **kwargs)
+        objs = list(objs)
+        for qc in objs:
+            qc.parseHeader()
+        fields = list(fields) + ([] if 'header' in fields else ['header'])
+        with transaction.atomic(using=self.db):
+            n = super().bulk_update(objs, fields, *args, **kwargs)
+            QualityCheckHeader.index(objs)
+        return n
+
+    def with_header(self, key, value):
+        "QCs whose header has key == value; key must be in QC_INDEXED_HEADER_KEYS"
+        return self.filter(headerValues__key=key, headerValues__value=str(value))
+
+    def with_header_between(self, key, low, high):
+        "QCs whose numerical header value for key is in [low, high]"
+        return self.filter(headerValues__key=key, headerValues__numValue__range=(low, high))
+
 class QualityCheck(models.Model):
     file = models.ForeignKey(File, on_delete=models.CASCADE)
     plotFile = models.ImageField(storage=qualityCheckStorage)
@@ -185,11 +461,24 @@ class QualityCheck(models.Model):
     dataBlock = models.IntegerField()
     packetIndex = models.BigIntegerField()
     headerStr = models.TextField()
+    # headerStr parsed when the QC is written
+    header = models.JSONField(null=True)
     done = models.BooleanField(default=False)
 
+    objects = QualityCheckQuerySet.as_manager()
+
     def __str__(self):
         return "QualityCheck for file %s, dataBlock %d" % (self.file, self.dataBlock)
 
+    def save(self, *args, **kwargs):
+        self.parseHeader()
+        super().save(*args, **kwargs)
+        QualityCheckHeader.index([self])
+
+    def parseHeader(self):
+        "Keep the header field in sync with headerStr"
+        self.header = parseHeaderStr(self.headerStr)
+
     def displayName(self):
         #return self.__str__()
         return "QC for proj %s, scan %s, bank %s, block %s" % (self.file.scan.projectId, self.file.scan.scanNum, self.file.bank.name, self.dataBlock)
@@ -208,19 +497,95 @@ class QualityCheck(models.Model):
         return hdr[key]
 
     def getHeaderDict(self):
-        "Retrieve a specific value from the string rep. of the header"
-        hdr = None
-        if self.headerStr is None:
-            return None
-        try:
-            hdr = eval(self.headerStr)
-        except:
-            print("Could not evaluate header as dictionary")
-            return None
-        return hdr
+        "The header as a dictionary, parsed when this QC was saved"
+        if self.header is None and self.headerStr:
+            # not saved since the header field was added
+            self.parseHeader()
+        return self.header
+
+class QualityCheckHeader(models.Model):
+    "Indexed copies of the QualityCheck header values in QC_INDEXED_HEADER_KEYS"
+
+    qualityCheck = models.ForeignKey(QualityCheck, on_delete=models.CASCADE, related_name='headerValues')
+    key = models.CharField(max_length=64)
+    value = models.CharField(max_length=256)
+    numValue = models.FloatField(null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['key', 'value'], name='qcheader_key_value_idx'),
+            models.Index(fields=['key', 'numValue'], name='qcheader_key_numvalue_idx'),
+        ]
+
+    def __str__(self):
+        return "%s = %s for QC %s" % (self.key, self.value, self.qualityCheck_id)
+
+    @staticmethod
+    def index(qcs):
+        "Replace the indexed header values of these saved QCs"
+        qcs = list(qcs)
+        QualityCheckHeader.objects.filter(qualityCheck__in=[qc.pk for qc in qcs]).delete()
+        rows = [QualityCheckHeader(qualityCheck_id=qc.pk, key=k, value=v, numValue=n)
+                for qc in qcs for k, v, n in indexedHeaderValues(qc.header)]
+        QualityCheckHeader.objects.bulk_create(rows, batch_size=1000)
+
+class ProcessingQuerySet(SummarizedQuerySet):
+
+    def with_pid_running(self):
+        "Evaluate this queryset, checking all the pids with one round trip per bank host"
+        processings = list(self.select_related('bank'))
+        Processing.annotatePidRunning(processings)
+        return processings
+
+class HostProcessSnapshot(models.Model):
+    "What the poll_host_processes command last saw running on a bank host"
+
+    host = models.CharField(max_length=256, unique=True)
+    banks = models.JSONField(default=list)
+    reachable = models.BooleanField(default=False)
+    dspsrPids = models.JSONField(default=list)
+    # the Processing pids we looked for, and which of those were running
+    checkedPids = models.JSONField(default=list)
+    runningPids = models.JSONField(default=list)
+    latency = models.FloatField(null=True) # seconds
+    error = models.TextField(null=True)
+    sampleTime = models.DateTimeField('sample time')
+
+    def __str__(self):
+        return "HostProcessSnapshot for %s at %s" % (self.host, self.getSampleTimeStr())
+
+    def getSampleTimeStr(self):
+        return formatDt(self.sampleTime)
 
+    def isFresh(self, maxAge=None):
+        if maxAge is None:
+            maxAge = HOST_SNAPSHOT_MAX_AGE
+        return (getDt() - self.sampleTime).total_seconds() < maxAge
 
+    def isDspsrRunning(self):
+        "None if we couldn't reach the host"
+        if not self.reachable:
+            return None
+        return len(self.dspsrPids) > 0
 
+    def isPidRunning(self, pid):
+        "True or False if this snapshot knows about pid, otherwise None"
+        if not self.reachable:
+            return None
+        if pid in self.dspsrPids or pid in self.runningPids:
+            return True
+        if pid in self.checkedPids:
+            return False
+        return None
+
+    @staticmethod
+    def forBanks(maxAge=None):
+        "{bank name: snapshot} of the snapshots that aren't stale"
+        snapshots = {}
+        for snap in HostProcessSnapshot.objects.all():
+            if snap.isFresh(maxAge):
+                snapshots.update([(b, snap) for b in snap.banks])
+        return snapshots
 
 class Processing(models.Model):
 
@@ -235,6 +600,14 @@ class Processing(models.Model):
     pid = models.IntegerField(null = True)
     reprocess = models.BooleanField(default=False)
 
+    objects = ProcessingQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            # Scan.getBankProcessedState assumes one of these per scan and bank
+            models.UniqueConstraint(fields=['scan', 'bank', 'processingType'], name='unique_processing_per_scan_bank_type'),
+        ]
+
     def __str__(self):
         return "Processing bank %s for %s" % (self.bank, self.scan)
 
@@ -253,8 +626,194 @@ class Processing(models.Model):
         return self.processedState == PROCESSED_COMPLETED
 
     def isPidRunning(self):
+        # Processing.annotatePidRunning may have already checked for us
+        if hasattr(self, 'pidRunning'):
+            return self.pidRunning
+        if self.pid is None:
+            return False
+        # then see if the poller has, before asking the host ourselves
+        snap = HostProcessSnapshot.forBanks().get(self.bank.name)
+        running = snap.isPidRunning(self.pid) if snap is not None else None
+        if running is not None:
+            return running
         return isPidRunning(self.pid, self.bank.name)
 
+    @staticmethod
+    def annotatePidRunning(processings):
+        "Set pidRunning on each of these Processing objects, from snapshots or one batch of remote checks"
+        snapshots = HostProcessSnapshot.forBanks()
+        unknown = []
+        for p in processings:
+            snap = snapshots.get(p.bank.name)
+            p.pidRunning = snap.isPidRunning(p.pid) if snap is not None and p.pid is not None else None
+            if p.pidRunning is None:
+                unknown.append(p)
+        running = arePidsRunning([(p.bank.name, p.pid) for p in unknown])
+        for p in unknown:
+            p.pidRunning = running[(p.bank.name, p.pid)]
+        return processings
+
+class ScanSummary(models.Model):
+    "Denormalized rollup of a scan's files, processing and quality checks"
+
+    scan = models.OneToOneField(Scan, on_delete=models.CASCADE, related_name='summary')
+    fileCount = models.IntegerField(default=0)
+    rawFileCount = models.IntegerField(default=0)
+    deletedFileCount = models.IntegerField(default=0)
+    liveBytes = models.BigIntegerField(default=0)
+    liveRawBytes = models.BigIntegerField(default=0)
+    deletedBytes = models.BigIntegerField(default=0)
+    # bank name -> worst processedState of that bank
+    bankStates = models.JSONField(default=dict)
+    worstProcessedState = models.CharField(max_length=256, choices=PROCESSED_STATES_CHOICES,
+                                           default=PROCESSED_NOT_STARTED)
+    qualityCheckCount = models.IntegerField(default=0)
+    updated = models.DateTimeField('last refreshed', auto_now=True)
+
+    def __str__(self):
+        return "ScanSummary for %s" % self.scan_id
+
+    def isProcessed(self):
+        return self.worstProcessedState == PROCESSED_COMPLETED
+
+    @staticmethod
+    def scheduleRefresh(scanIds):
+        "Refresh these scans once the current transaction commits (right away in autocommit)"
+        scanIds = set(i for i in scanIds if i is not None)
+        if scanIds:
+            transaction.on_commit(lambda: ScanSummary.refresh(scanIds))
+
+    @staticmethod
+    def refresh(scanIds, chunkSize=500):
+        "Recompute the summaries of the given scans with a few grouped queries per chunk"
+        scanIds = sorted(scanIds)
+        for i in range(0, len(scanIds), chunkSize):
+            ScanSummary._refreshChunk(scanIds[i:i+chunkSize])
+
+    @staticmethod
+    def _refreshChunk(scanIds):
+        # the scan may have been deleted since the refresh was scheduled
+        scanIds = list(Scan.objects.filter(id__in=scanIds).values_list('id', flat=True))
+        summaries = {i: ScanSummary(scan_id=i) for i in scanIds}
+        files = File.objects.filter(scan_id__in=scanIds).values('scan').annotate(
+            nFiles=Count('id'),
+            nRaw=Count('id', filter=Q(fileType='raw')),
+            nDeleted=Count('id', filter=Q(deleted=True)),
+            live=Sum('size', filter=Q(deleted=False)),
+            liveRaw=Sum('size', filter=Q(deleted=False, fileType='raw')),
+            dead=Sum('size', filter=Q(deleted=True)),
+        )
+        for f in files:
+            ss = summaries[f['scan']]
+            ss.fileCount = f['nFiles']
+            ss.rawFileCount = f['nRaw']
+            ss.deletedFileCount = f['nDeleted']
+            ss.liveBytes = f['live'] or 0
+            ss.liveRawBytes = f['liveRaw'] or 0
+            ss.deletedBytes = f['dead'] or 0
+        ranks = Processing.objects.filter(scan_id__in=scanIds).values('scan', 'bank__name').annotate(
+            rank=Max(processedStateRank()))
+        for p in ranks:
+            ss = summaries[p['scan']]
+            ss.bankStates[p['bank__name']] = PROCESSED_STATES[p['rank']]
+        for ss in summaries.values():
+            if ss.bankStates:
+                ss.worstProcessedState = PROCESSED_STATES[max(PROCESSED_STATES.index(st) for st in ss.bankStates.values())]
+        qcs = QualityCheck.objects.filter(file__scan_id__in=scanIds).values('file__scan').annotate(n=Count('id'))
+        for qc in qcs:
+            summaries[qc['file__scan']].qualityCheckCount = qc['n']
+        fields = [f.name for f in ScanSummary._meta.concrete_fields if f.name not in ('id', 'scan')]
+        ScanSummary.objects.bulk_create(summaries.values(), update_conflicts=True,
+                                        unique_fields=['scan'], update_fields=fields)
+
+    @staticmethod
+    def rebuild(chunkSize=500):
+        "Throw away all summaries and recompute them from scratch"
+        scanIds = list(Scan.objects.order_by('id').values_list('id', flat=True))
+        with transaction.atomic():
+            ScanSummary.objects.all().delete()
+            ScanSummary.refresh(scanIds, chunkSize=chunkSize)
+        return len(scanIds)
+
+    @staticmethod
+    def projectTotals(projectId):
+        "How much data does this project have left, and how much of it is processed?"
+        return ScanSummary.objects.filter(scan__projectId=projectId).aggregate(
+            scans=Count('id'),
+            processedScans=Count('id', filter=Q(worstProcessedState=PROCESSED_COMPLETED)),
+            files=Sum('fileCount'),
+            liveBytes=Sum('liveBytes'),
+            liveRawBytes=Sum('liveRawBytes'),
+            deletedBytes=Sum('deletedBytes'),
+        )
+
+class BackgroundJob(models.Model):
+    "Progress of long running requests handed off to a worker thread"
+
+    kind = models.CharField(max_length=256)
+    state = models.CharField(max_length=256, choices=JOB_STATES_CHOICES, default=JOB_PENDING)
+    total = models.IntegerField(default=0)
+    done = models.IntegerField(default=0)
+    params = models.JSONField(default=dict)
+    result = models.TextField(null=True)
+    created = models.DateTimeField('created', auto_now_add=True)
+    updated = models.DateTimeField('last progress', auto_now=True)
+
+    def __str__(self):
+        return "%s job %d: %s %d/%d" % (self.kind, self.id, self.state, self.done, self.total)
+
+    def isFinished(self):
+        return self.state in (JOB_DONE, JOB_FAILED)
+
+    def percentDone(self):
+        if self.total == 0:
+            return 100.0 if self.isFinished() else 0.0
+        return 100.0 * self.done / self.total
+
+    def isStale(self, now=None):
+        "Unfinished, and no heartbeat from it's worker for JOB_STALE_SECONDS"
+        now = now or timezone.now()
+        return not self.isFinished() and (now - self.updated).total_seconds() > JOB_STALE_SECONDS
+
+    def failIfStale(self):
+        "Mark this job FAILED if it's worker is gone; returns whether it was"
+        if not self.isStale():
+            return False
+        result = "worker stopped (no heartbeat since %s)" % formatDt(self.updated)
+        # unless the worker has just caught up
+        n = BackgroundJob.objects.filter(id=self.id, state=self.state, updated=self.updated).update(
+            state=JOB_FAILED, result=result)
+        self.refresh_from_db()
+        return n == 1
+
+class ProcessingStateChange(models.Model):
+    "Append only history of changes to Processing.processedState"
+
+    processing = models.ForeignKey(Processing, on_delete=models.CASCADE, related_name='stateChanges')
+    oldState = models.CharField(max_length=256, choices=PROCESSED_STATES_CHOICES)
+    newState = models.CharField(max_length=256, choices=PROCESSED_STATES_CHOICES)
+    changeTime = models.DateTimeField('change time')
+
+    def __str__(self):
+        return "Processing %s: %s -> %s at %s" % (self.processing_id, self.oldState, self.newState, self.getChangeTimeStr())
+
+    def getChangeTimeStr(self):
+        return formatDt(self.changeTime)
+
+    @staticmethod
+    def setState(processings, newState):
+        "Set the state of a Processing queryset in one update, logging what it was before"
+        now = getDt()
+        with transaction.atomic():
+            old = list(processings.select_for_update().order_by().values_list('id', 'processedState'))
+            if not old:
+                return 0
+            processings.update(processedState=newState)
+            ProcessingStateChange.objects.bulk_create([
+                ProcessingStateChange(processing_id=pk, oldState=state, newState=newState, changeTime=now)
+                for pk, state in old], batch_size=1000)
+        return len(old)
+
 class Status(models.Model):
 
     heartbeat = models.DateTimeField('should be updated with latest time', null=True)
@@ -263,8 +822,12 @@ class Status(models.Model):
     currentState = models.CharField(max_length=256, null=True)
     currentCycSpec = models.BooleanField(default=False)
 
+    def getHeartbeat(self):
+        "Latest heartbeat, which may not have been flushed to the DB yet"
+        return getHeartbeat(self, STATUS)
+
     def getHeartbeatStr(self):
-        return formatDt(self.heartbeat)
+        return formatDt(self.getHeartbeat())
 
     @staticmethod
     def create_singleton():
@@ -283,21 +846,31 @@ class BankStatus(models.Model):
     def __str__(self):
         return "BankStatus for Bank %s" % self.bank.name
 
+    def getProcessingHeartbeat(self):
+        "Latest heartbeat, which may not have been flushed to the DB yet"
+        return getHeartbeat(self, PROCESSING)
+
+    def getQualityCheckHeartbeat(self):
+        "Latest heartbeat, which may not have been flushed to the DB yet"
+        return getHeartbeat(self, QUALITY_CHECK)
+
     def getProcessingHeartbeatStr(self):
-        return formatDt(self.processingHeartbeat)
+        return formatDt(self.getProcessingHeartbeat())
 
     def getQualityCheckHeartbeatStr(self):
-        return formatDt(self.qualityCheckHeartbeat)
+        return formatDt(self.getQualityCheckHeartbeat())
 
     def isQualityCheckHeartbeatRecent(self):
-        if self.qualityCheckHeartbeat is None:
+        hb = self.getQualityCheckHeartbeat()
+        if hb is None:
             return False
-        return (getDt() - self.qualityCheckHeartbeat).seconds < 60
+        return (getDt() - hb).total_seconds() < 60
 
     def isProcessingHeartbeatRecent(self):
-        if self.processingHeartbeat is None:
+        hb = self.getProcessingHeartbeat()
+        if hb is None:
             return False
-        return (getDt() - self.processingHeartbeat).seconds < 60
+        return (getDt() - hb).total_seconds() < 60
 
     def hasQualityCheck(self):
         return self.qualityCheck is not None
@@ -331,21 +904,31 @@ class BankStatusX(models.Model):
     def displayName(self):
         return self.__str__()
 
+    def getProcessingHeartbeat(self):
+        "Latest heartbeat, which may not have been flushed to the DB yet"
+        return getHeartbeat(self, PROCESSING)
+
+    def getQualityCheckHeartbeat(self):
+        "Latest heartbeat, which may not have been flushed to the DB yet"
+        return getHeartbeat(self, QUALITY_CHECK)
+
     def getProcessingHeartbeatStr(self):
-        return formatDt(self.processingHeartbeat)
+        return formatDt(self.getProcessingHeartbeat())
 
     def getQualityCheckHeartbeatStr(self):
-        return formatDt(self.qualityCheckHeartbeat)
+        return formatDt(self.getQualityCheckHeartbeat())
 
     def isQualityCheckHeartbeatRecent(self):
-        if self.qualityCheckHeartbeat is None:
+        hb = self.getQualityCheckHeartbeat()
+        if hb is None:
             return False
-        return (getDt() - self.qualityCheckHeartbeat).seconds < 60
+        return (getDt() - hb).total_seconds() < 60
 
     def isProcessingHeartbeatRecent(self):
-        if self.processingHeartbeat is None:
+        hb = self.getProcessingHeartbeat()
+        if hb is None:
             return False
-        return (getDt() - self.processingHeartbeat).seconds < 60
+        return (getDt() - hb).total_seconds() < 60
 
     def hasQualityCheck(self):
         return self.qualityCheck is not None
@@ -0,0 +1,134 @@
+"""
+Reconcile File rows with what's actually on disk.
+
+File.exists() stats one file at a time, which over the NFS mounts takes
+forever for a whole project.  Here the files are grouped by directory,
+each directory is listed just once with os.scandir (on a pool of
+threads, since it's all waiting on the file server), and the listings
+are compared against the DB: files that have gone are marked deleted,
+files that have come back are marked not deleted, and sizes that have
+changed are updated, all in bulk.
+
+A directory is only taken to be gone if the base dir it's under (the
+mount) is there and has something in it; an NFS mount that isn't
+mounted looks just like a project whose directories were all deleted.
+"""
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import File
+
+RECONCILE_WORKERS = getattr(settings, 'RECONCILE_WORKERS', 16)
+
+# how many rows to update per query
+UPDATE_BATCH_SIZE = 1000
+
+
+def checkBaseDir(baseDir):
+    "Raise an OSError unless baseDir is a readable directory with something in it"
+    with os.scandir(baseDir) as entries:
+        if next(entries, None) is None:
+            raise OSError("%s is empty; is it mounted?" % baseDir)
+
+def listDir(path, names, baseDir=None):
+    """
+    {filename: size} for those of 'names' that are regular files in path,
+    or None if path doesn't exist (but baseDir, if given, does).  Other
+    errors (permissions, a stale or missing mount) are raised, since then
+    we don't know what's there.
+    """
+    found = {}
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                # only stat the files we're asking about
+                if entry.name in names and entry.is_file():
+                    found[entry.name] = entry.stat().st_size
+    except FileNotFoundError:
+        if baseDir is not None:
+            checkBaseDir(baseDir)
+        return None
+    return found
+
+def groupByDir(files):
+    """
+    {directory: {filename: (file id, size, deleted)}} for these files,
+    and {directory: the base dir it's under}
+    """
+    rows = files.values_list('id', 'baseDir', 'scan__projectId', 'deviceDir', 'bank__name',
+                             'filename', 'size', 'deleted')
+    dirs = {}
+    baseDirs = {}
+    for fileId, baseDir, proj, deviceDir, bankName, filename, size, deleted in rows.iterator(chunk_size=5000):
+        path = File.buildPath(baseDir, proj, deviceDir, bankName, filename)
+        dirPath, name = os.path.split(path)
+        dirs.setdefault(dirPath, {})[name] = (fileId, size, deleted)
+        baseDirs[dirPath] = baseDir
+    return dirs, baseDirs
+
+def compare(dirs, listings):
+    "What needs changing in the DB, given each directory's listing"
+    report = dict(files=0, directories=len(dirs), missingDirectories=[], unreadableDirectories=[],
+                  nowDeleted=[], nowPresent=[], sizeChanged={})
+    for dirPath, files in dirs.items():
+        report['files'] += len(files)
+        found = listings[dirPath]
+        if isinstance(found, Exception):
+            # we don't know, so leave these files alone
+            report['unreadableDirectories'].append((dirPath, str(found)))
+            continue
+        if found is None:
+            report['missingDirectories'].append(dirPath)
+            found = {}
+        for name, (fileId, size, deleted) in files.items():
+            if name not in found:
+                if not deleted:
+                    report['nowDeleted'].append(fileId)
+                continue
+            if deleted:
+                report['nowPresent'].append(fileId)
+            if found[name] != size:
+                report['sizeChanged'][fileId] = found[name]
+    return report
+
+def apply(report):
+    "Bulk update the File rows the report found out of date"
+    ids = lambda l: [l[i:i + UPDATE_BATCH_SIZE] for i in range(0, len(l), UPDATE_BATCH_SIZE)]
+    with transaction.atomic():
+        for batch in ids(report['nowDeleted']):
+            File.objects.filter(id__in=batch).update(deleted=True)
+        for batch in ids(report['nowPresent']):
+            File.objects.filter(id__in=batch).update(deleted=False)
+        sizes = [File(id=fileId, size=size) for fileId, size in report['sizeChanged'].items()]
+        File.objects.bulk_update(sizes, ['size'], batch_size=UPDATE_BATCH_SIZE)
+
+def reconcileFiles(files=None, workers=None, dryRun=False):
+    """
+    Check these Files (all of them by default) against the disk, fix the
+    DB unless dryRun, and return a report of what was found
+    """
+    if files is None:
+        files = File.objects.all()
+    start = time.monotonic()
+    dirs, baseDirs = groupByDir(files)
+
+    def listing(dirPath):
+        try:
+            return listDir(dirPath, dirs[dirPath], baseDirs[dirPath])
+        except OSError as e:
+            logging.error("Could not list %s: %s" % (dirPath, e))
+            return e
+
+    with ThreadPoolExecutor(max_workers=workers or RECONCILE_WORKERS, thread_name_prefix='reconcile') as pool:
+        listings = dict(zip(dirs, pool.map(listing, dirs)))
+    report = compare(dirs, listings)
+    report['dryRun'] = dryRun
+    if not dryRun:
+        apply(report)
+    report['seconds'] = time.monotonic() - start
+    return report
@@ -0,0 +1,83 @@
+"""
+Micro-benchmark of the pulsar filename parser (utils.parsePulsarName)
+against the split() based parsers it replaced, on a synthetic listing:
+
+    python manage.py runscript bench_filenames --script-args names=1000000
+
+The listing is raw and fits files (a tenth of them cal scans) for
+'names' / 'filesPerScan' scans, like a VEGAS data dir.
+"""
+import random
+import time
+
+import utils
+from mdb.scripts.script_args import parseArgs
+
+
+# --script-args and their defaults
+DEFAULTS = dict(names=1000000, filesPerScan=20, seed=0)
+
+
+def makeListing(opts):
+    rnd = random.Random(opts['seed'])
+    sources = ['J0340+4130', 'B1937+21', 'J1713+0747', 'CAL', 'none']
+    names = []
+    scanNum = 0
+    while len(names) < opts['names']:
+        scanNum += 1
+        mjd, secs = 59000 + scanNum // 100, rnd.randint(0, 86399)
+        source = rnd.choice(sources)
+        cal = '_cal' if scanNum % 10 == 0 else ''
+        for i in range(opts['filesPerScan']):
+            if i % 2:
+                names.append("vegas_%d_%d_%s_%04d%s_%04d.fits" % (mjd, secs, source, scanNum % 10000, cal, i))
+            else:
+                names.append("vegas_%d_%d_%s_%04d.%04d.raw" % (mjd, secs, source, scanNum % 10000, i))
+    return names[:opts['names']]
+
+def legacyFits(filename):
+    "parsePulsarFitsFilename before the regex grammar"
+    calOffset = -13
+    scanIdx = 4
+    if 'cal' in filename and filename[calOffset:calOffset+3] == 'cal':
+        fileNumIdx = scanIdx + 2
+    else:
+        fileNumIdx = scanIdx + 1
+    thisScanNum = int(filename.split('_')[scanIdx])
+    fileNum = filename.split('_')[fileNumIdx]
+    thisFileNum = int(fileNum.split('.')[0])
+    return thisScanNum, thisFileNum
+
+def legacyRaw(filename):
+    "parsePulsarRawFilename before the regex grammar"
+    end = filename.split('_')[4]
+    return int(end.split('.')[0]), int(end.split('.')[1])
+
+def timeIt(label, fn, n):
+    t = time.perf_counter()
+    fn()
+    dt = time.perf_counter() - t
+    print("%-45s %6.2f s  %7.0f k names/s" % (label, dt, n / dt / 1e3))
+
+def run(*args):
+    opts = parseArgs(args, DEFAULTS)
+    names = makeListing(opts)
+    n = len(names)
+    print("%d names, e.g. %s, %s\n" % (n, names[0], names[1]))
+
+    timeIt("legacy split() parsers", lambda: [legacyFits(f) if f.endswith('.fits') else legacyRaw(f)
+                                              for f in names], n)
+    # ingest only sees each file once (the watchers only return files that
+    # are new since the last pass), so this is the case that matters
+    utils.parsePulsarName.cache_clear()
+    timeIt("parseMany, cold cache", lambda: utils.parseMany(names), n)
+    # the cache only pays off for callers that parse the same names again
+    recent = names[-10000:]
+    timeIt("parseMany, the last 10k names again", lambda: utils.parseMany(recent), len(recent))
+    print("\n%s" % (utils.parsePulsarName.cache_info(), ))
+
+    # the new parser agrees with the old one where the old one was right
+    for f in names[:100000]:
+        p = utils.parsePulsarName(f)
+        old = legacyFits(f) if f.endswith('.fits') else legacyRaw(f)
+        assert (p.scanNum, p.fileNum) == old, (f, p, old)
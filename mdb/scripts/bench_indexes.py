@@ -0,0 +1,190 @@
+"""
+Benchmark the hot lookup paths with and without the indexes from
+migration 0003_hot_path_indexes.  The BEFORE run also drops the unique
+constraint from 0008_file_unique, since it's index leads with
+mdb_file.scan_id and would otherwise stand in for 0003's File index.
+
+Runs against a throw away test database (like 'manage.py test' does),
+so it's safe to point at a configured production settings file:
+
+    python manage.py runscript bench_indexes --script-args scans=20000 files=100
+
+which makes 2M File rows, 480k Processing rows and 200k QualityChecks.
+"""
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from django.db import connection
+
+from mdb.models import BANKNAMES, Bank, File, Processing, QualityCheck, Scan, PROCESSED_STATES, PROCESSING_CYCSPEC
+from mdb.scripts.script_args import parseArgs
+
+
+# --script-args and their defaults
+DEFAULTS = dict(scans=20000, files=100, qcEvery=10, repeats=200, seed=0)
+
+
+def insertRows(model, columns, rows, batchSize=50000):
+    "Skip the ORM (and the ScanSummary bookkeeping) to load rows quickly"
+    table = model._meta.db_table
+    qn = connection.ops.quote_name
+    sql = "INSERT INTO %s (%s) VALUES (%s)" % (table,
+        ", ".join(qn(c) for c in columns),
+        ", ".join(["%s"] * len(columns)))
+    batch = []
+    with connection.cursor() as cursor:
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= batchSize:
+                cursor.executemany(sql, batch)
+                batch = []
+        if batch:
+            cursor.executemany(sql, batch)
+
+def makeData(opts):
+    "Synthetic projects with every scan writing files on every bank"
+    Bank.objects.bulk_create([Bank(name=n) for n in BANKNAMES])
+    banks = dict(Bank.objects.values_list('name', 'id'))
+    bankIds = [banks[n] for n in BANKNAMES]
+    t0 = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    nScans = opts['scans']
+
+    def scans():
+        for i in range(nScans):
+            start = t0 + timedelta(minutes=i)
+            yield (i + 1, 'AGBT23A_%03d_01' % (i // 200), i % 200 + 1, start, start + timedelta(minutes=1),
+                   60, 'VEGAS', 'Rcvr1_2', 'MODEc0100x0064', 'J0340+4130', True)
+    insertRows(Scan, ['id', 'projectId', 'scanNum', 'startTime', 'endTime', 'duration',
+                      'backend', 'receiver', 'mode', 'source', 'cycspec'], scans())
+
+    def files():
+        fileId = 0
+        for scanId in range(1, nScans + 1):
+            start = t0 + timedelta(minutes=scanId)
+            for j in range(opts['files']):
+                fileId += 1
+                bankIdx = j % len(bankIds)
+                fileType = 'raw' if j % 4 else 'fits'
+                yield (fileId, scanId, bankIds[bankIdx], 'vegas_60000_%05d_J0340+4130_%04d.%04d.%s' % (scanId % 86400, scanId % 10000, j, fileType),
+                       '/home/cycspec-hpc13', 'VEGAS_CODD', fileType, start + timedelta(seconds=j), 2**30, j, False, j % 7 == 0)
+    insertRows(File, ['id', 'scan_id', 'bank_id', 'filename', 'baseDir', 'deviceDir', 'fileType',
+                      'creationTime', 'size', 'fileNum', 'done', 'deleted'], files())
+
+    def processing():
+        for scanId in range(1, nScans + 1):
+            for bankId in bankIds:
+                yield (scanId, bankId, PROCESSING_CYCSPEC, random.choice(PROCESSED_STATES), False)
+    insertRows(Processing, ['scan_id', 'bank_id', 'processingType', 'processedState', 'reprocess'], processing())
+
+    def qcs():
+        nFiles = nScans * opts['files']
+        for fileId in range(1, nFiles + 1, opts['qcEvery']):
+            yield (fileId, 'qc.png', 1024, t0, fileId % 16, fileId, "{'OBSFREQ': 1500.0}", False)
+    insertRows(QualityCheck, ['file_id', 'plotFile', 'fileSize', 'checkTime', 'dataBlock',
+                              'packetIndex', 'headerStr', 'done'], qcs())
+
+def hotPaths(opts):
+    "name -> function of a random scan that builds the queryset to run"
+    scanNums = dict(Scan.objects.values_list('id', 'scanNum'))
+    projects = dict(Scan.objects.values_list('id', 'projectId'))
+    bank = lambda: random.choice(BANKNAMES)
+    return {
+        'forms: Scan by project, scanNum': lambda sid: Scan.objects.filter(projectId=projects[sid], scanNum=scanNums[sid]),
+        'Scan.getCycspecFiles(bank)': lambda sid: Scan(pk=sid).getCycspecFiles(bankName=bank()),
+        'Scan.getBankProcessedState': lambda sid: Scan(pk=sid).processing_set.filter(bank__name=bank()),
+        'Scan.getQualityChecks': lambda sid: Scan(pk=sid).getQualityChecks(),
+        'scan list page (seek)': lambda sid: Scan.objects.select_related('summary').seek(
+            after=Scan.objects.filter(pk=sid).values_list('startTime', 'id').first())[:50],
+    }
+
+def measure(paths, opts, label):
+    print("\n===== %s =====" % label)
+    nScans = opts['scans']
+    for name, build in paths.items():
+        print("\n--- %s" % name)
+        print(build(1).explain())
+        times = []
+        for _ in range(opts['repeats']):
+            qs = build(random.randint(1, nScans))
+            t = time.perf_counter()
+            list(qs)
+            times.append(time.perf_counter() - t)
+        times.sort()
+        print("mean %.3f ms, p95 %.3f ms over %d runs" % (1e3 * sum(times) / len(times),
+            1e3 * times[int(0.95 * (len(times) - 1))], len(times)))
+
+# what 0003_hot_path_indexes added, by name
+HOT_PATH_INDEXES = [
+    (File, 'file_scan_type_bank_ctime_idx'),
+    (Scan, 'scan_project_scannum_idx'),
+    (Scan, 'scan_starttime_id_idx'),
+]
+HOT_PATH_CONSTRAINTS = [
+    (Processing, 'unique_processing_per_scan_bank_type'),
+    # from 0008_file_unique, but it indexes (scan, bank, filename)
+    (File, 'unique_file_per_scan_bank'),
+]
+
+def hotPathIndexes():
+    "(model, index) and (model, constraint) pairs to drop for the BEFORE run"
+    def byName(model, name, objs):
+        for obj in objs:
+            if obj.name == name:
+                return (model, obj)
+        raise LookupError("%s has no index or constraint called %s" % (model.__name__, name))
+    indexes = [byName(m, name, m._meta.indexes) for m, name in HOT_PATH_INDEXES]
+    constraints = [byName(m, name, m._meta.constraints) for m, name in HOT_PATH_CONSTRAINTS]
+    return indexes, constraints
+
+def existingIndexes(model):
+    "Names of the indexes and constraints model's table has right now"
+    with connection.cursor() as cursor:
+        return set(connection.introspection.get_constraints(cursor, model._meta.db_table))
+
+def run(*args):
+    opts = parseArgs(args, DEFAULTS)
+    random.seed(opts['seed'])
+    oldName = connection.settings_dict['NAME']
+    testDb = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        print("test database: %s" % testDb)
+        t = time.perf_counter()
+        makeData(opts)
+        print("loaded %d scans, %d files, %d processing, %d quality checks in %.1f s" % (
+            Scan.objects.count(), File.objects.count(), Processing.objects.count(),
+            QualityCheck.objects.count(), time.perf_counter() - t))
+        paths = hotPaths(opts)
+        indexes, constraints = hotPathIndexes()
+
+        # sqlite drops a constraint by remaking the table from the model,
+        # so take them out of the models too while we measure without them
+        meta = dict([(m, (m._meta.indexes, m._meta.constraints)) for m, _ in indexes + constraints])
+        for model, index in indexes:
+            model._meta.indexes = [i for i in model._meta.indexes if i is not index]
+        for model, constraint in constraints:
+            model._meta.constraints = [c for c in model._meta.constraints if c is not constraint]
+        with connection.schema_editor() as editor:
+            for model, constraint in constraints:
+                editor.remove_constraint(model, constraint)
+        with connection.schema_editor() as editor:
+            for model, index in indexes:
+                if index.name in existingIndexes(model):
+                    editor.remove_index(model, index)
+        measure(paths, opts, "BEFORE (no hot path indexes)")
+
+        t = time.perf_counter()
+        for model, (modelIndexes, modelConstraints) in meta.items():
+            model._meta.indexes, model._meta.constraints = modelIndexes, modelConstraints
+        # and remaking the table for a constraint brings back the indexes
+        with connection.schema_editor() as editor:
+            for model, constraint in constraints:
+                editor.add_constraint(model, constraint)
+        with connection.schema_editor() as editor:
+            for model, index in indexes:
+                if index.name not in existingIndexes(model):
+                    editor.add_index(model, index)
+        print("\nbuilt indexes in %.1f s" % (time.perf_counter() - t))
+        measure(paths, opts, "AFTER (with hot path indexes)")
+    finally:
+        connection.creation.destroy_test_db(oldName, verbosity=0)
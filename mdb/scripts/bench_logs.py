@@ -0,0 +1,81 @@
+"""
+Benchmark reading cycspec logs: utils.getDtFromLogLine's positional
+fast path against the strptime one it falls back on, alone and inside
+parseCycspecLogFile, on a synthetic log:
+
+    python manage.py runscript bench_logs --script-args lines=3000000
+
+The log has a few lines a second, with the odd traceback, like the
+processing daemon's.
+"""
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+import utils
+from mdb.scripts.script_args import parseArgs
+
+
+# --script-args and their defaults
+DEFAULTS = dict(lines=3000000, linesPerSecond=4, seed=0)
+
+
+def writeLog(fn, opts):
+    "Returns the times of the first and last lines"
+    rnd = random.Random(opts['seed'])
+    t0 = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    levels = ['[INFO]'] * 8 + ['[DEBUG]', '[WARNING]']
+    with open(fn, 'w') as f:
+        for i in range(opts['lines']):
+            t = t0 + timedelta(seconds=i // opts['linesPerSecond'])
+            f.write("%s,%03d [cycspecProcess] %s processing scan %d, bank %s\n" % (
+                t.strftime("%Y-%m-%d %H:%M:%S"), rnd.randint(0, 999), rnd.choice(levels),
+                i // 1000, chr(ord('A') + i % 24)))
+            if i % 5000 == 0:
+                f.write("Traceback (most recent call last):\n  File \"x.py\", line 1\nValueError: oops\n")
+    return t0, t
+
+def timeIt(label, fn):
+    t = time.perf_counter()
+    # parseCycspecLogFile prints
+    with contextlib.redirect_stdout(io.StringIO()):
+        n = fn()
+    dt = time.perf_counter() - t
+    print("%-55s %7.2f s  %7.0f k lines/s" % (label, dt, n / dt / 1e3))
+    return dt
+
+def run(*args):
+    opts = parseArgs(args, DEFAULTS)
+    with tempfile.TemporaryDirectory() as tmp:
+        fn = os.path.join(tmp, 'cycspecProcess.d.1.2023_01_01_00:00:00')
+        t0, t1 = writeLog(fn, opts)
+        print("%d line log, %.0f MB\n" % (opts['lines'], os.path.getsize(fn) / 1e6))
+        with open(fn) as f:
+            lines = f.readlines()
+
+        slow = timeIt("getDtFromLogLineStrptime, every line",
+                      lambda: len([utils.getDtFromLogLineStrptime(l) for l in lines]))
+        fast = timeIt("getDtFromLogLine, every line",
+                      lambda: len([utils.getDtFromLogLine(l) for l in lines]))
+        print("%.1fx faster\n" % (slow / fast))
+
+        # the whole log, so every line's timestamp is looked at
+        start, end = t0, t1 - timedelta(seconds=1)
+        fastDt = utils.getDtFromLogLine
+        try:
+            utils.getDtFromLogLine = utils.getDtFromLogLineStrptime
+            slow = timeIt("parseCycspecLogFile, whole log, strptime",
+                          lambda: len(utils.parseCycspecLogFile(fn, start, end)))
+        finally:
+            utils.getDtFromLogLine = fastDt
+        fast = timeIt("parseCycspecLogFile, whole log, fast path",
+                      lambda: len(utils.parseCycspecLogFile(fn, start, end)))
+        print("%.1fx faster" % (slow / fast))
+
+        # they agree
+        for l in lines[:200000]:
+            assert utils.getDtFromLogLine(l) == utils.getDtFromLogLineStrptime(l), l
@@ -0,0 +1,113 @@
+"""
+Throughput and tail latency of the remote probes in utils.py against
+simulated bank hosts (see transports.SimulatedTransport), so they can be
+measured without the VEGAS HPC hosts:
+
+    python manage.py runscript bench_probes --script-args latency=0.02 jitter=0.03 failureRate=0.01
+
+Each of the 24 banks gets its own simulated host with a few hundred
+processes, and dspsr running on 'dspsrHosts' of them.
+"""
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+from djangoTest import settings
+from mdb.models import BANKNAMES
+from mdb.scripts.script_args import parseArgs
+from transports import SimulatedTransport, setTransport
+import utils
+
+
+# --script-args and their defaults
+DEFAULTS = dict(latency=0.02, jitter=0.02, failureRate=0.0, iterations=50,
+                processes=300, dspsrHosts=1, timeout=2.0, seed=0)
+
+
+def writeSystemConf(ygorDir, hosts):
+    "A system.conf with just the bank hosts in it"
+    configDir = os.path.join(ygorDir, 'etc/config')
+    os.makedirs(configDir)
+    with open(os.path.join(configDir, 'system.conf'), 'w') as f:
+        f.write("# simulated bank hosts\n")
+        for bank, host in hosts.items():
+            f.write('VegasBank%sHost := "%s"\n' % (bank, host))
+
+def makeProcessTables(hosts, opts, rnd):
+    "{host: {pid: program}}, with dspsr on the last 'dspsrHosts' hosts"
+    tables = {}
+    for i, host in enumerate(hosts):
+        pids = rnd.sample(range(1000, 400000), opts['processes'])
+        table = dict([(pid, 'proc%d' % pid) for pid in pids])
+        if i >= len(hosts) - opts['dspsrHosts']:
+            table[pids[0]] = utils.DSPSR_EXE
+        tables[host] = table
+    return tables
+
+def measure(name, fn, iterations, unknown=None):
+    """
+    Run fn iterations times; report calls per second, latency percentiles,
+    the calls that raised, and how many answers unknown(fn()) says were
+    PROBE_UNKNOWN (or otherwise not known), so that probes that were
+    skipped or timed out don't pass for fast ones
+    """
+    times = []
+    errors = unknowns = 0
+    start = time.perf_counter()
+    # the probes print as they go; keep that out of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(iterations):
+            t = time.perf_counter()
+            try:
+                result = fn()
+                if unknown is not None:
+                    unknowns += unknown(result)
+            except Exception:
+                # a failed connection is raised by the single host probes
+                errors += 1
+            times.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+    times.sort()
+    pct = lambda p: 1e3 * times[min(len(times) - 1, int(p * len(times)))]
+    print("%-40s %8.1f calls/s  p50 %7.1f ms  p95 %7.1f ms  p99 %7.1f ms  max %7.1f ms  errors %d  unknown %d" % (
+        name, iterations / total, pct(0.50), pct(0.95), pct(0.99), 1e3 * times[-1], errors, unknowns))
+
+def run(*args):
+    opts = parseArgs(args, DEFAULTS)
+    rnd = random.Random(opts['seed'])
+    hosts = dict([(b, 'vegas-sim%02d' % i) for i, b in enumerate(BANKNAMES)])
+    tables = makeProcessTables(list(hosts.values()), opts, rnd)
+    transport = SimulatedTransport(processTables=tables, latency=opts['latency'], jitter=opts['jitter'],
+                                   failureRate=opts['failureRate'], seed=opts['seed'])
+    oldYgor = getattr(settings, 'YGOR_TELESCOPE', None)
+    oldTransport = setTransport(transport)
+    oldExecutor = utils.probeExecutor
+    utils.probeExecutor = utils.ProbeExecutor(maxWorkers=len(hosts), timeout=opts['timeout'])
+    try:
+        with tempfile.TemporaryDirectory() as ygorDir:
+            settings.YGOR_TELESCOPE = ygorDir
+            writeSystemConf(ygorDir, hosts)
+            print("%d simulated hosts, latency %s s + up to %s s jitter, failure rate %s, dspsr on %d hosts\n" % (
+                len(hosts), opts['latency'], opts['jitter'], opts['failureRate'], opts['dspsrHosts']))
+            n = opts['iterations']
+            banks = list(BANKNAMES)
+            measure("detectCSProcessing(24 banks)", lambda: utils.detectCSProcessing(banks), n,
+                    unknown=lambda r: int(r == utils.PROBE_UNKNOWN))
+            measure("getProcessingPids(24 banks)", lambda: utils.getProcessingPids(banks), n,
+                    unknown=lambda r: r.count(utils.PROBE_UNKNOWN))
+            # 10 (bank, pid) pairs per bank, half of them running
+            pairs = []
+            for b in banks:
+                running = list(tables[hosts[b]])[:5]
+                pairs.extend([(b, p) for p in running] + [(b, p) for p in range(10, 15)])
+            measure("isPidRunning, one pid per call", lambda: utils.isPidRunning(*reversed(rnd.choice(pairs))), n * 4)
+            measure("arePidsRunning(%d pids, 24 hosts)" % len(pairs), lambda: utils.arePidsRunning(pairs),
+                    max(1, n // 5), unknown=lambda r: list(r.values()).count(None))
+            print("\ntransport: %s" % transport.stats())
+    finally:
+        settings.YGOR_TELESCOPE = oldYgor
+        setTransport(oldTransport)
+        utils.probeExecutor = oldExecutor
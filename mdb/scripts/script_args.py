@@ -0,0 +1,17 @@
+"""
+Helpers shared by the scripts in mdb/scripts; not a script itself.
+"""
+
+
+def parseArgs(args, defaults):
+    """
+    runscript passes --script-args along as 'key=value' strings; returns
+    a copy of defaults with those values, each of the type of it's default
+    """
+    opts = dict(defaults)
+    for arg in args:
+        k, v = arg.split('=')
+        if k not in opts:
+            raise ValueError("unknown script argument %s; expected one of %s" % (k, sorted(opts)))
+        opts[k] = type(opts[k])(v)
+    return opts
@@ -0,0 +1,53 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from .models import File, Processing, QualityCheck, Scan, ScanSummary
+
+
+# keep ScanSummary up to date as single objects come and go;
+# bulk operations are handled in SummarizedQuerySet
+
+def cascadedFrom(origin, *models):
+    "Was this delete started by deleting one (or a queryset) of these models?"
+    originModel = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return issubclass(originModel, models)
+
+@receiver(post_save, sender=Scan)
+def scanSaved(sender, instance, created, **kwargs):
+    if created:
+        ScanSummary.scheduleRefresh([instance.id])
+
+# remember where objects were loaded from, so that when one is moved to
+# another scan, the scan it left is refreshed too; a deferred field isn't
+# in __dict__, and isn't worth a query to find out
+
+@receiver(post_init, sender=File)
+@receiver(post_init, sender=Processing)
+def rememberScan(sender, instance, **kwargs):
+    instance._savedScanId = instance.__dict__.get('scan_id')
+
+@receiver(post_init, sender=QualityCheck)
+def rememberFile(sender, instance, **kwargs):
+    instance._savedFileId = instance.__dict__.get('file_id')
+
+@receiver(post_save, sender=File)
+@receiver(post_delete, sender=File)
+@receiver(post_save, sender=Processing)
+@receiver(post_delete, sender=Processing)
+def fileOrProcessingChanged(sender, instance, origin=None, **kwargs):
+    if origin is not None and cascadedFrom(origin, Scan):
+        # the summary is going too
+        return
+    ScanSummary.scheduleRefresh([instance.scan_id, getattr(instance, '_savedScanId', None)])
+    instance._savedScanId = instance.scan_id
+
+@receiver(post_save, sender=QualityCheck)
+@receiver(post_delete, sender=QualityCheck)
+def qualityCheckChanged(sender, instance, origin=None, **kwargs):
+    if origin is not None and not cascadedFrom(origin, QualityCheck):
+        # deleted with it's file, whose own handler refreshes the scan
+        return
+    fileIds = set([instance.file_id, getattr(instance, '_savedFileId', None)])
+    ScanSummary.scheduleRefresh(File.objects.filter(id__in=fileIds).values_list('scan_id', flat=True))
+    instance._savedFileId = instance.file_id
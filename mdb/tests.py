@@ -1,3 +1,715 @@
-from django.test import TestCase
+import io
+import os
+import tempfile
+import time
+from contextlib import redirect_stdout
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from mdb import ingest, jobs
+from mdb.reconcile import reconcileFiles
+from mdb.models import (BackgroundJob, Bank, File, Processing, QualityCheck, Scan, ScanSummary,
+                        JOB_FAILED, JOB_RUNNING, JOB_STALE_SECONDS, PROCESSED_COMPLETED, PROCESSING_CYCSPEC)
+
+import utils
+from transports import ConnectionPool, SimulatedTransport, setTransport
+
+
+class FakeConnection:
+    "Stands in for a fabric Connection; 'fail' is raised by the next run()"
+
+    def __init__(self, host):
+        self.host = host
+        self.is_connected = True
+        self.closed = False
+        self.fail = None
+        self.commands = []
+
+    def run(self, cmd, **kwargs):
+        if self.fail is not None:
+            fail, self.fail = self.fail, None
+            raise fail
+        self.commands.append(cmd)
+        return "%s: %s" % (self.host, cmd)
+
+    def close(self):
+        self.closed = True
+        self.is_connected = False
+
+class ConnectionPoolTest(SimpleTestCase):
+
+    def setUp(self):
+        self.made = []
+
+    def factory(self, host):
+        conn = FakeConnection(host)
+        self.made.append(conn)
+        return conn
+
+    def pool(self, **kwargs):
+        kwargs.setdefault('maxIdle', 10)
+        kwargs.setdefault('idleTimeout', 300)
+        return ConnectionPool(connectionFactory=self.factory, **kwargs)
+
+    def test_reuse(self):
+        pool = self.pool()
+        self.assertEqual(pool.run('h1', 'ls'), 'h1: ls')
+        pool.run('h1', 'ls')
+        pool.run('h2', 'ls')
+        self.assertEqual([c.host for c in self.made], ['h1', 'h2'])
+        self.assertEqual(self.made[0].commands, ['ls', 'ls'])
+        stats = pool.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['idle']), (1, 2, 2))
+
+    def test_reconnect(self):
+        pool = self.pool()
+        pool.run('h1', 'ls')
+        self.made[0].fail = EOFError()
+        self.assertEqual(pool.run('h1', 'ls'), 'h1: ls')
+        self.assertEqual(len(self.made), 2)
+        self.assertTrue(self.made[0].closed)
+        self.assertEqual(pool.stats()['reconnects'], 1)
+        # the new connection is the one put back
+        pool.run('h1', 'ls')
+        self.assertEqual(len(self.made[1].commands), 2)
+
+    def test_reconnect_fails(self):
+        pool = self.pool()
+        pool.run('h1', 'ls')
+        self.made[0].fail = EOFError()
+        original = self.factory
+        def failing(host):
+            conn = original(host)
+            conn.fail = OSError("unreachable")
+            return conn
+        pool.connectionFactory = failing
+        with self.assertRaises(OSError):
+            pool.run('h1', 'ls')
+        self.assertTrue(all([c.closed for c in self.made]))
+        self.assertEqual(pool.numIdle(), 0)
+
+    def test_other_errors_discard(self):
+        "A command that fails some other way (say, it timed out) doesn't leak it's connection"
+        pool = self.pool()
+        pool.run('h1', 'ls')
+        self.made[0].fail = RuntimeError("command timed out")
+        with self.assertRaises(RuntimeError):
+            pool.run('h1', 'ls')
+        self.assertTrue(self.made[0].closed)
+        self.assertEqual(pool.numIdle(), 0)
+        self.assertEqual(pool.stats()['reconnects'], 0)
+
+    def test_max_idle(self):
+        pool = self.pool(maxIdle=2)
+        for host in ['h1', 'h2', 'h3']:
+            pool.run(host, 'ls')
+        self.assertEqual(pool.numIdle(), 2)
+        self.assertEqual(pool.stats()['evictions'], 1)
+        # the oldest goes
+        self.assertEqual([c.closed for c in self.made], [True, False, False])
+
+    def test_idle_timeout(self):
+        pool = self.pool(idleTimeout=0)
+        pool.run('h1', 'ls')
+        pool.run('h1', 'ls')
+        self.assertEqual(len(self.made), 2)
+        self.assertTrue(self.made[0].closed)
+        self.assertEqual(pool.stats()['evictions'], 1)
+
+    def test_dead_connection(self):
+        pool = self.pool()
+        pool.run('h1', 'ls')
+        self.made[0].is_connected = False
+        pool.run('h1', 'ls')
+        self.assertEqual(len(self.made), 2)
+        self.assertEqual(pool.stats()['hits'], 0)
+
+    def test_fork(self):
+        pool = self.pool()
+        pool.run('h1', 'ls')
+        # as if we're now in a forked child
+        pool.pid = -1
+        pool.run('h1', 'ls')
+        self.assertEqual(len(self.made), 2)
+        # the parent's connection is left alone for the parent
+        self.assertFalse(self.made[0].closed)
+        self.assertEqual(pool.numIdle(), 1)
+
+class ScanDetailViewTest(TestCase):
+
+    def setUp(self):
+        self.banks = [Bank.objects.create(name=n) for n in 'ABC']
+
+    def makeScan(self, numFiles):
+        t = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        scan = Scan.objects.create(projectId='AGBT24A_001_01', scanNum=numFiles, startTime=t, duration=60,
+                                   backend='VEGAS', receiver='Rcvr1_2', mode='MODEc0100x0064')
+        File.objects.bulk_create([
+            File(scan=scan, bank=self.banks[i % 3], filename='vegas_60310_100_J0340+4130_%04d.%04d.raw' % (numFiles, i),
+                 baseDir='/tmp', deviceDir='VEGAS_CODD', fileType='raw', creationTime=t, size=100, fileNum=i)
+            for i in range(numFiles)])
+        files = list(scan.file_set.order_by('id')[:2])
+        QualityCheck.objects.bulk_create([
+            QualityCheck(file=f, plotFile='qc.png', fileSize=100, checkTime=t, dataBlock=0, packetIndex=0,
+                         headerStr=str({'NCHAN': 64}))
+            for f in files])
+        for bank in self.banks:
+            Processing.objects.create(scan=scan, bank=bank, processingType=PROCESSING_CYCSPEC,
+                                      processedState=PROCESSED_COMPLETED)
+        ScanSummary.rebuild()
+        return scan
+
+    def test_query_count(self):
+        "The same handful of queries whether the scan has a few files or a lot"
+        for numFiles in (5, 200):
+            scan = self.makeScan(numFiles)
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('scan-detail', args=[scan.pk]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(len(response.context['files']), numFiles)
+
+class BackgroundJobTest(TestCase):
+
+    def test_stale_job_fails(self):
+        "A job whose worker died with it's process is reported FAILED, not RUNNING forever"
+        job = BackgroundJob.objects.create(kind='test', state=JOB_RUNNING, total=10)
+        response = self.client.get(reverse('job-progress', args=[job.pk]))
+        self.assertEqual(response.json()['state'], JOB_RUNNING)
+        old = timezone.now() - timedelta(seconds=JOB_STALE_SECONDS + 1)
+        BackgroundJob.objects.filter(id=job.id).update(updated=old)
+        response = self.client.get(reverse('job-progress', args=[job.pk]))
+        self.assertEqual(response.json()['state'], JOB_FAILED)
+        self.assertTrue(response.json()['finished'])
+
+    def test_heartbeat(self):
+        "A running job keeps it's updated time fresh"
+        job = BackgroundJob.objects.create(kind='test', state=JOB_RUNNING, total=10)
+        old = timezone.now() - timedelta(seconds=JOB_STALE_SECONDS + 1)
+        BackgroundJob.objects.filter(id=job.id).update(updated=old)
+        # one beat, then stop
+        stopped = mock.Mock()
+        stopped.wait.side_effect = [False, True]
+        with mock.patch.object(jobs.connection, 'close'):
+            jobs.heartbeat(job.id, stopped)
+        job.refresh_from_db()
+        self.assertFalse(job.isStale())
+
+class ScanSummaryTest(TestCase):
+    "Moving files and QCs to another scan refreshes both scans' summaries"
+
+    def setUp(self):
+        t = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        self.bank = Bank.objects.create(name='A')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.scans = [Scan.objects.create(projectId='AGBT24A_001_01', scanNum=n, startTime=t, duration=60,
+                                              backend='VEGAS', receiver='Rcvr1_2', mode='MODEc0100x0064')
+                          for n in (1, 2)]
+            self.files = [File.objects.create(scan=self.scans[0], bank=self.bank, filename='f%d.raw' % i,
+                                              baseDir='/tmp', deviceDir='VEGAS_CODD', fileType='raw',
+                                              creationTime=t, size=100, fileNum=i)
+                          for i in range(4)]
+            self.qc = QualityCheck.objects.create(file=self.files[0], plotFile='qc.png', fileSize=100,
+                                                  checkTime=t, dataBlock=0, packetIndex=0, headerStr='{}')
+
+    def counts(self, field='fileCount'):
+        return [ScanSummary.objects.get(scan=s).__dict__[field] for s in self.scans]
+
+    def test_update(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            File.objects.filter(id=self.files[1].id).update(scan=self.scans[1])
+        self.assertEqual(self.counts(), [3, 1])
+        with self.captureOnCommitCallbacks(execute=True):
+            File.objects.filter(id=self.files[2].id).update(scan_id=self.scans[1].id)
+        self.assertEqual(self.counts(), [2, 2])
+
+    def test_bulk_update(self):
+        f = File.objects.get(id=self.files[1].id)
+        f.scan = self.scans[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            File.objects.bulk_update([f], ['scan'])
+        self.assertEqual(self.counts(), [3, 1])
+
+    def test_save(self):
+        f = File.objects.get(id=self.files[1].id)
+        f.scan = self.scans[1]
+        with self.captureOnCommitCallbacks(execute=True):
+            f.save()
+        self.assertEqual(self.counts(), [3, 1])
+
+    def test_quality_check(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            File.objects.filter(id=self.files[3].id).update(scan=self.scans[1])
+        self.assertEqual(self.counts('qualityCheckCount'), [1, 0])
+        with self.captureOnCommitCallbacks(execute=True):
+            QualityCheck.objects.filter(id=self.qc.id).update(file=self.files[3])
+        self.assertEqual(self.counts('qualityCheckCount'), [0, 1])
+        qc = QualityCheck.objects.get(id=self.qc.id)
+        qc.file = self.files[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            qc.save()
+        self.assertEqual(self.counts('qualityCheckCount'), [1, 0])
+
+    def test_cascade(self):
+        "Deleting a file doesn't cost a query per QualityCheck it takes with it"
+        t = self.qc.checkTime
+        def deleteFile(f, numQCs):
+            QualityCheck.objects.bulk_create([
+                QualityCheck(file=f, plotFile='qc.png', fileSize=100, checkTime=t, dataBlock=i, packetIndex=0,
+                             headerStr='{}')
+                for i in range(numQCs)])
+            with CaptureQueriesContext(connection) as queries:
+                with self.captureOnCommitCallbacks(execute=True):
+                    f.delete()
+            return len(queries)
+        self.assertEqual(deleteFile(self.files[1], 2), deleteFile(self.files[2], 50))
+        self.assertEqual(self.counts(), [2, 0])
+        self.assertEqual(self.counts('qualityCheckCount'), [1, 0])
+
+class ProbeExecutorTest(SimpleTestCase):
+
+    hosts = ['h%d' % i for i in range(24)]
+
+    def setUp(self):
+        # dspsr is running on h0, which answers first
+        self.transport = SimulatedTransport({'h0': {1: utils.DSPSR_EXE}}, latency=0.05, hostLatency={'h0': 0})
+        self.previous = setTransport(self.transport)
+        self.executor = utils.ProbeExecutor(maxWorkers=24, timeout=2)
+        patches = [mock.patch.object(utils, 'probeExecutor', self.executor),
+                   mock.patch.object(utils, 'getBankHosts', lambda banks: self.hosts),
+                   redirect_stdout(io.StringIO())]
+        for p in patches:
+            p.__enter__()
+            self.addCleanup(p.__exit__, None, None, None)
+
+    def tearDown(self):
+        setTransport(self.previous)
+
+    def test_back_to_back(self):
+        "Probes first() stopped waiting for are waited on, not skipped"
+        self.assertIs(utils.detectCSProcessing(self.hosts), True)
+        self.assertEqual(utils.getProcessingPids(self.hosts), [1] + [None] * 23)
+        # rather than probing every host twice
+        self.assertLess(self.transport.stats()['calls'], 48)
+
+    def test_other_probe(self):
+        "A different probe of a host that's busy with another is still run"
+        utils.detectCSProcessing(self.hosts)
+        results = self.executor.map(lambda host: utils.isProgramRunning(host, 'other'), self.hosts)
+        self.assertEqual(results, [None] * 24)
+
+    def test_hung_host(self):
+        "A host whose probe has overrun it's timeout is skipped until it finishes"
+        def probe(host):
+            # like a transport that doesn't honour the timeout
+            time.sleep(0.5 if host == 'h1' else 0)
+            return host
+        self.assertEqual(self.executor.map(probe, self.hosts[:3], timeout=0.1), ['h0', utils.PROBE_UNKNOWN, 'h2'])
+        start = time.monotonic()
+        self.assertEqual(self.executor.map(probe, self.hosts[:3], timeout=0.1), ['h0', utils.PROBE_UNKNOWN, 'h2'])
+        self.assertLess(time.monotonic() - start, 0.1)
+        time.sleep(0.5)
+        self.assertEqual(self.executor.numInFlight(), 0)
+
+class PulsarNameTest(SimpleTestCase):
+
+    # name -> (mjd, seconds, source, scanNum, cal, fileNum, extension)
+    names = {
+        'vegas_59956_65259_J0340+4130_0004_0001.fits': (59956, 65259, 'J0340+4130', 4, False, 1, 'fits'),
+        'vegas_59956_65260_J0340+4130_0001.0000.raw': (59956, 65260, 'J0340+4130', 1, False, 0, 'raw'),
+        'vegas_59956_48356_CAL_0011_cal_0001.fits': (59956, 48356, 'CAL', 11, True, 1, 'fits'),
+        'vegas_59956_48356_CAL_0011_cal.0002.raw': (59956, 48356, 'CAL', 11, True, 2, 'raw'),
+        # sources with underscores, and numbers after them
+        'vegas_59956_48356_3C_286_0012_0003.fits': (59956, 48356, '3C_286', 12, False, 3, 'fits'),
+        'vegas_59956_48356_3C_286_0012_cal_0003.fits': (59956, 48356, '3C_286', 12, True, 3, 'fits'),
+        'vegas_59956_48356_B1937_21_0005.0001.raw': (59956, 48356, 'B1937_21', 5, False, 1, 'raw'),
+        'vegas_59956_48356_B1937_21_0005_cal.0001.raw': (59956, 48356, 'B1937_21', 5, True, 1, 'raw'),
+        # 'cal' in the source isn't a cal scan
+        'vegas_59956_48356_cal_src_0005_0001.fits': (59956, 48356, 'cal_src', 5, False, 1, 'fits'),
+        'vegas_59956_48356_3C_cal_0005.0001.raw': (59956, 48356, '3C_cal', 5, False, 1, 'raw'),
+    }
+
+    rejected = [
+        '',
+        'vegas_59956_65259_J0340+4130_0004.fits',
+        'vegas_59956_65259_J0340+4130_0004_0001.raw',
+        'vegas_59956_65260_J0340+4130_0001.0000.fits',
+        'vegas_59956_65259_J0340+4130_0004_0001.fits.tmp',
+        'vegas_59956_65259_J0340+4130_0004_cal.fits',
+        'vegas_59956_65259_J0340+4130_cal_0001.fits',
+        'vegas_59956_65259_0004_0001.fits',
+        'vegas_5995a_65259_J0340+4130_0004_0001.fits',
+        'vegas_59956_65259_J0340+4130_abcd_0001.fits',
+        '_59956_65259_J0340+4130_0004_0001.fits',
+        'J0340+4130_0004_0001.fits',
+        'vegas_59956_65259_J0340+4130_0004_cal_cal_0001.fits',
+    ]
+
+    def test_names(self):
+        "Every field of each name, with or without the cache"
+        for name, fields in self.names.items():
+            for parse in (utils.parsePulsarName, utils.parsePulsarName.__wrapped__):
+                p = parse(name)
+                self.assertEqual(tuple([getattr(p, a) for a in p.__slots__]), fields, name)
+            fitsOrRaw = utils.parsePulsarFitsFilename if fields[-1] == 'fits' else utils.parsePulsarRawFilename
+            self.assertEqual(fitsOrRaw(name), (fields[3], fields[5]))
+
+    def test_rejected(self):
+        for name in self.rejected:
+            with self.assertRaisesRegex(ValueError, "Not a VEGAS pulsar data file name"):
+                utils.parsePulsarName(name)
+        names = list(self.names)
+        self.assertEqual(utils.parseMany(self.rejected + names),
+                         [None] * len(self.rejected) + [utils.parsePulsarName(n) for n in names])
+
+class ReconcileFilesTest(TestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.baseDir = os.path.join(tmp.name, 'cycspec-hpc1')
+        t = datetime(2024, 1, 1, tzinfo=dt_timezone.utc)
+        banks = [Bank.objects.create(name=n) for n in 'AB']
+        self.scan = Scan.objects.create(projectId='AGBT24A_001_01', scanNum=1, startTime=t, duration=60,
+                                        backend='VEGAS', receiver='Rcvr1_2', mode='MODEc0100x0064')
+        self.files = [File.objects.create(scan=self.scan, bank=bank, filename='f%d.raw' % i, baseDir=self.baseDir,
+                                          deviceDir='VEGAS_CODD', fileType='raw', creationTime=t, size=10, fileNum=i)
+                      for bank in banks for i in range(2)]
+
+    def write(self, f, size=10):
+        path = f.getFullPath()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as fp:
+            fp.write('x' * size)
+
+    def deleted(self):
+        return sorted(File.objects.filter(deleted=True).values_list('id', flat=True))
+
+    def test_reconcile(self):
+        # bank A's files are there, one a different size; bank B's dir is gone
+        self.write(self.files[0])
+        self.write(self.files[1], size=20)
+        report = reconcileFiles()
+        self.assertEqual(self.deleted(), [self.files[2].id, self.files[3].id])
+        self.assertEqual(report['missingDirectories'], [os.path.dirname(self.files[2].getFullPath())])
+        self.assertEqual(File.objects.get(id=self.files[1].id).size, 20)
+
+    def test_missing_base_dir(self):
+        "An unmounted base dir means we don't know, not that everything's deleted"
+        report = reconcileFiles()
+        self.assertEqual(self.deleted(), [])
+        self.assertEqual(report['missingDirectories'], [])
+        self.assertEqual(len(report['unreadableDirectories']), 2)
+
+    def test_empty_base_dir(self):
+        "An empty mount point looks like one that isn't mounted"
+        os.makedirs(self.baseDir)
+        reconcileFiles()
+        self.assertEqual(self.deleted(), [])
+
+def inotifyEvents(events):
+    "inotify_simple Events with these (wd, mask)s"
+    from inotify_simple import Event
+    return [Event(wd, mask, 0, '') for wd, mask in events]
+
+@skipUnless(ingest.INotify is not None, "inotify_simple is not installed")
+class InotifyWatcherTest(SimpleTestCase):
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dataDir = tmp.name
+        self.bankDir = os.path.join(self.dataDir, 'AGBT24A_001_01', 'VEGAS_CODD', 'A')
+        os.makedirs(self.bankDir)
+        self.watcher = ingest.InotifyWatcher(self.dataDir, interval=0.1)
+        self.addCleanup(self.watcher.inotify.close)
+
+    def write(self, dirPath, name):
+        path = os.path.join(dirPath, name)
+        with open(path, 'w') as f:
+            f.write('x')
+        return path
+
+    def test_new_files(self):
+        path = self.write(self.bankDir, 'f1.raw')
+        newBank = os.path.join(self.dataDir, 'AGBT24A_001_01', 'VEGAS_CODD', 'B')
+        os.makedirs(newBank)
+        other = self.write(newBank, 'f2.raw')
+        found = self.watcher.newFiles() + self.watcher.newFiles()
+        self.assertEqual(sorted(found), sorted([path, other]))
+
+    def test_overflow(self):
+        "Files whose events were lost to an overflow are found by a rescan"
+        old = self.write(self.bankDir, 'old.raw')
+        self.watcher.newFiles()
+        time.sleep(1.1)
+        self.watcher.newFiles()
+        lost = self.write(self.bankDir, 'lost.raw')
+        missed = os.path.join(self.dataDir, 'AGBT24A_001_01', 'VEGAS')
+        os.makedirs(os.path.join(missed, 'A'))
+        inMissed = self.write(os.path.join(missed, 'A'), 'f.fits')
+        overflow = inotifyEvents([(-1, ingest.flags.Q_OVERFLOW)])
+        with mock.patch.object(self.watcher.inotify, 'read', return_value=overflow):
+            found = self.watcher.newFiles()
+        self.assertEqual(sorted(found), sorted([lost, inMissed]))
+        self.assertNotIn(old, found)
+        self.assertEqual(self.watcher.overflows, 1)
+
+    def test_ignored(self):
+        "Watches on deleted dirs are forgotten"
+        wd = [wd for wd, (path, depth) in self.watcher.watches.items() if path == self.bankDir][0]
+        with mock.patch.object(self.watcher.inotify, 'read', return_value=inotifyEvents([(wd, ingest.flags.IGNORED)])):
+            self.watcher.newFiles()
+        self.assertNotIn(wd, self.watcher.watches)
+
+def logLineOutcome(getDt, ln):
+    "What getDt makes of ln: a datetime, None, or the type of error it raised"
+    try:
+        return getDt(ln)
+    except ValueError:
+        return ValueError
+
+class LogLineTest(SimpleTestCase):
+
+    lines = [
+        "2022-12-14 13:51:40,189 [utils] [INFO] dspsr cmd:\n",
+        "2022-12-14 13:51:40,190 [utils] [ERROR] same second\n",
+        "2022-12-14 13:51:41,000 [cycspec] [DEBUG] next second",
+        "2022-12-14 13:51:41,001 [utils] [WARNING] ",
+        "2022-12-14 13:51:41,001 [utils] [FAULT]",
+        # dates and times that don't exist
+        "2023-02-30 13:51:40,189 [utils] [INFO] no such day\n",
+        "2023-02-28 24:00:00,000 [utils] [INFO] no such hour\n",
+        "2023-13-01 00:00:00,000 [utils] [INFO] no such month\n",
+        "2024-02-29 23:59:59,999 [utils] [INFO] leap day\n",
+        "2022-12-14 13:51:4x,189 [utils] [INFO] not a number\n",
+        "2022-12-14 13:51:\u00b2\u00b2,189 [utils] [INFO] superscripts\n",
+        "2022-12-14T13:51:40,189 [utils] [INFO] wrong separator\n",
+        # modules in brackets, and brackets that aren't levels
+        "2022-12-14 13:51:40,189 [utils] [cycspec] [INFO] nested module\n",
+        "2022-12-14 13:51:40,189 [mdb [ingest]] [INFO] brackets in the module\n",
+        "2022-12-14 13:51:40,189 [utils] [NOTICE] not a level\n",
+        "2022-12-14 13:51:40,189 [utils] INFO no brackets\n",
+        "2022-12-14 13:51:40,189 [utils] [NOTICE] then [INFO] later\n",
+        "2022-12-14 13:51:40,189 [utils] [INFO\n",
+        "2022-12-14 13:51:40,189 [utils]\n",
+        # not where we log the timestamp
+        "  2022-12-14 13:51:40,189 [utils] [INFO] indented\n",
+        "2022-12-14 13:51:40.189 [utils] [INFO] dot for a comma\n",
+        "2022-12-14 13:51:40,18 [utils] [INFO] short millis\n",
+        "Traceback (most recent call last):\n",
+        "  File \"utils.py\", line 1, in <module> [INFO]\n",
+        "\n",
+        "",
+    ]
+
+    def test_agrees_with_strptime(self):
+        "Line by line with nothing cached, then all in a row, sharing the cached second"
+        for ln in self.lines:
+            with mock.patch.object(utils, 'lastLogSecond', (None, None)):
+                self.assertEqual(logLineOutcome(utils.getDtFromLogLine, ln),
+                                 logLineOutcome(utils.getDtFromLogLineStrptime, ln), ln)
+        with mock.patch.object(utils, 'lastLogSecond', (None, None)):
+            for i in range(3):
+                for ln in self.lines:
+                    self.assertEqual(logLineOutcome(utils.getDtFromLogLine, ln),
+                                     logLineOutcome(utils.getDtFromLogLineStrptime, ln), (i, ln))
+
+    def test_cached_second(self):
+        "A line from the second we decoded last is answered from the cache"
+        first, second = self.lines[:2]
+        with mock.patch.object(utils, 'lastLogSecond', (None, None)):
+            dt = utils.getDtFromLogLine(first)
+            self.assertEqual(utils.lastLogSecond, (first[:19], dt))
+            with mock.patch.object(utils, 'datetime', side_effect=AssertionError("not cached")):
+                self.assertIs(utils.getDtFromLogLine(second), dt)
+            # a bad date doesn't replace what's cached
+            with self.assertRaises(ValueError):
+                utils.getDtFromLogLine(self.lines[5])
+            self.assertEqual(utils.lastLogSecond, (first[:19], dt))
+
+def writeLog(path, start, seconds, linesPerSecond=3, preamble=True):
+    """
+    A cycspec style log with linesPerSecond lines a second, a traceback
+    after each second's last line, and, if preamble, a few untimestamped
+    lines before the first; returns it's lines
+    """
+    lines = ["Starting up\n", "config: cycspec.conf\n"] if preamble else []
+    for s in range(seconds):
+        ts = (start + timedelta(seconds=s)).strftime("%Y-%m-%d %H:%M:%S")
+        for i in range(linesPerSecond):
+            lines.append("%s,%03d [utils] [INFO] line %d of second %d %s\n" % (ts, i, i, s, 'x' * (s % 40)))
+        lines.extend(["Traceback (most recent call last):\n", "  ValueError: %d\n" % s])
+    with open(path, 'w') as f:
+        f.writelines(lines)
+    return lines
+
+def logRange(lines, start, end=None):
+    "What readLogRange should give, by reading every line"
+    found = []
+    inWindow = False
+    for i, l in enumerate(lines):
+        dt = utils.getDtFromLogLineStrptime(l)
+        if dt is not None:
+            if end is not None and dt > end:
+                break
+            if not inWindow and dt >= start:
+                inWindow = True
+                # a preamble goes with the first line
+                if not [m for m in lines[:i] if utils.getDtFromLogLineStrptime(m) is not None]:
+                    found.extend(lines[:i])
+        if inWindow:
+            found.append(l)
+    return found
+
+class LogRangeTest(SimpleTestCase):
+
+    t0 = datetime(2023, 1, 1, 12, 0, 0, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'cycspecProcess.d.1.2023_01_01_12:00:00')
+        self.lines = writeLog(self.path, self.t0, 300)
+
+    def at(self, seconds):
+        return self.t0 + timedelta(seconds=seconds)
+
+    def test_windows(self):
+        for start, end in [(-10, None), (0, 0), (0, 10), (1, None), (150, 150), (150.5, 160.5), (17, 299),
+                           (299, None), (299, 1000), (-10, -5)]:
+            end = None if end is None else self.at(end)
+            self.assertEqual(list(utils.readLogRange(self.path, self.at(start), end)),
+                             logRange(self.lines, self.at(start), end), (start, end))
+
+    def test_preamble(self):
+        "The lines before the first timestamp only come with the start of the log"
+        lines = list(utils.readLogRange(self.path, self.at(-1), self.at(0)))
+        self.assertEqual(lines[:2], self.lines[:2])
+        lines = list(utils.readLogRange(self.path, self.at(1), self.at(1)))
+        self.assertTrue(lines[0].startswith("2023-01-01 12:00:01,000"))
+
+    def test_after_end(self):
+        "A start after the last line gives nothing (parseCycspecLogFile used to give the whole file)"
+        self.assertEqual(list(utils.readLogRange(self.path, self.at(301))), [])
+
+    def test_tracebacks(self):
+        "Untimestamped lines go with the line before them, even at the end of the window"
+        lines = list(utils.readLogRange(self.path, self.at(5), self.at(5)))
+        self.assertEqual(len(lines), 5)
+        self.assertTrue(lines[-1].startswith("  ValueError: 5"))
+
+    def test_resync(self):
+        "Offsets in the middle of a line find the start of the next timestamped one"
+        with open(self.path, 'rb') as f:
+            data = f.read()
+            for offset in [0, 1, 30, len(data) // 2, len(data) - 5]:
+                pos, dt = utils.logLineTimestamp(f, offset)
+                if pos is None:
+                    self.assertEqual(data[offset:].count(b'[INFO]'), 0)
+                    continue
+                self.assertGreaterEqual(pos, offset)
+                self.assertTrue(pos == 0 or data[pos - 1:pos] == b'\n')
+                self.assertEqual(dt, utils.getDtFromLogLineStrptime(data[pos:data.index(b'\n', pos)].decode()))
+                # and no timestamped line starts in between
+                self.assertNotIn(b',000 [utils]', data[offset:pos])
+
+    def test_find_offset(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+            for s in [0, 1, 100, 299]:
+                pos = utils.findLogOffset(f, self.at(s))
+                self.assertTrue(data[pos:].startswith(self.at(s).strftime("%Y-%m-%d %H:%M:%S,000").encode()))
+            self.assertIsNone(utils.findLogOffset(f, self.at(300)))
+
+class LogIndexTest(SimpleTestCase):
+
+    t0 = datetime(2023, 1, 1, 12, 0, 0, tzinfo=dt_timezone.utc)
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.indexDir = os.path.join(tmp.name, 'index')
+        self.path = os.path.join(tmp.name, 'cycspecProcess.d.1.2023_01_01_12:00:00')
+        self.data = ''.join(writeLog(self.path, self.t0, 200)).encode()
+
+    def index(self):
+        "A fresh LogIndex, with nothing in memory"
+        return utils.LogIndex(indexDir=self.indexDir, stride=512)
+
+    def writeUpTo(self, n):
+        with open(self.path, 'wb') as f:
+            f.write(self.data[:n])
+
+    def updateFrom(self, index):
+        "The offsets index.update extends the log's index from"
+        extend = utils.LogIndex.extend
+        starts = []
+        def spy(self, fn, idx):
+            starts.append(idx[1])
+            return extend(self, fn, idx)
+        with mock.patch.object(utils.LogIndex, 'extend', spy):
+            index.update(self.path)
+        return starts
+
+    def assertFinds(self, index, seconds):
+        with open(self.path, 'rb') as f:
+            for s in seconds:
+                start = self.t0 + timedelta(seconds=s)
+                self.assertEqual(index.find(self.path, start), utils.findLogOffset(f, start), s)
+
+    def test_growing_log(self):
+        "Indexes up to the last complete line, and carries on from there as the log grows"
+        half = len(self.data) // 2
+        # the last line is still being written
+        self.assertNotEqual(self.data[half - 1:half], b'\n')
+        self.writeUpTo(half)
+        index = self.index()
+        inode, indexedTo, epochs, offsets = index.update(self.path)
+        self.assertLessEqual(indexedTo, self.data.rindex(b'\n', 0, half) + 1)
+        self.assertLess(offsets[-1], indexedTo)
+        self.assertFinds(index, range(0, 200, 7))
+        # from the sidecar, with nothing new to index
+        self.assertEqual(self.updateFrom(self.index()), [indexedTo])
+        self.assertEqual(self.index().update(self.path), (inode, indexedTo, epochs, offsets))
+
+        self.writeUpTo(len(self.data))
+        index = self.index()
+        # picked up where the sidecar left off
+        self.assertEqual(self.updateFrom(index), [indexedTo])
+        newIndex = index.update(self.path)
+        # and ended up where indexing it from scratch would
+        fromScratch = utils.LogIndex(indexDir=self.indexDir + '2', stride=512).update(self.path)
+        self.assertEqual(newIndex, fromScratch)
+        self.assertGreater(len(newIndex[2]), len(epochs))
+        self.assertFinds(self.index(), range(0, 201, 3))
+
+    def test_replaced_log(self):
+        "A new file at the same path (new inode) is indexed from scratch"
+        index = self.index()
+        index.update(self.path)
+        other = self.path + '.new'
+        t1 = self.t0 + timedelta(days=1)
+        writeLog(other, t1, 50)
+        os.replace(other, self.path)
+        newIndex = self.index().update(self.path)
+        self.assertEqual(newIndex[0], os.stat(self.path).st_ino)
+        self.assertEqual(newIndex[2][0], int(t1.timestamp()))
+        fromScratch = utils.LogIndex(indexDir=self.indexDir + '2', stride=512).update(self.path)
+        self.assertEqual(newIndex, fromScratch)
+
+    def test_truncated_log(self):
+        "A log shorter than what we'd indexed is indexed again"
+        index = self.index()
+        index.update(self.path)
+        with open(self.path, 'r+b') as f:
+            f.truncate(1000)
+        inode, indexedTo, epochs, offsets = index.update(self.path)
+        self.assertLessEqual(indexedTo, 1000)
+        self.assertTrue(all([o < 1000 for o in offsets]))
+        self.assertFinds(self.index(), range(0, 20))
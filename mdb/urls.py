@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import ScanListView, ScanDetailView, ProcessingDetailView, set_processing_state, mark_files_deleted
+from .views import ScanListView, ScanDetailView, ProcessingDetailView, set_processing_state, mark_files_deleted, job_progress, status_json
 
 urlpatterns = [
     path('scans/', ScanListView.as_view(), name='scan-list'),
@@ -7,4 +7,6 @@ urlpatterns = [
     path('processing/<int:pk>/', ProcessingDetailView.as_view(), name='processing-detail'),
     path('set-processing-state/', set_processing_state, name='set-processing-state'),
     path('mark-files-deleted/', mark_files_deleted, name='mark-files-deleted'),
+    path('jobs/<int:pk>/', job_progress, name='job-progress'),
+    path('status/', status_json, name='status-json'),
 ]
@@ -1,44 +1,73 @@
-from .forms import MarkFilesDeletedForm
-from .models import File
+from django.conf import settings
 from django.contrib import messages
+from django.db import transaction
+from django.http import JsonResponse
+from django.shortcuts import get_object_or_404
+from .forms import MarkFilesDeletedForm
+from .jobs import startJob, updateInChunks
+from .models import BackgroundJob
+
+# project wide requests bigger than this are done by a worker thread
+MARK_FILES_DELETED_BACKGROUND_THRESHOLD = getattr(settings, 'MARK_FILES_DELETED_BACKGROUND_THRESHOLD', 10000)
+
+def markFilesDeletedJob(job):
+    "BackgroundJob work for mark_files_deleted"
+    params = job.params
+    files = MarkFilesDeletedForm.files_for(params['projectId'], params['scanNum'], params['bankId'])
+    n = updateInChunks(job, files, deleted=True)
+    return "Marked %d files as deleted. %s" % (n, params['details'])
+
 def mark_files_deleted(request):
     form = MarkFilesDeletedForm(request.POST or None)
     message = None
     warning = None
+    job = None
     if request.method == 'POST' and form.is_valid():
         scanNum = form.cleaned_data.get('scanNum')
         if not scanNum and not request.POST.get('confirm_all_scans'):
             warning = "This will mark all files in the project as deleted. Are you sure you want to continue?"
         else:
             files = form.get_files()
-            updated_count = 0
-            affected_projects = set()
-            affected_scans = set()
-            affected_banks = set()
-            for f in files:
-                f.deleted = True
-                f.save()
-                updated_count += 1
-                if hasattr(f, 'scan') and f.scan:
-                    affected_projects.add(f.scan.projectId)
-                    affected_scans.add(f.scan.scanNum)
-                if hasattr(f, 'bank') and f.bank:
-                    affected_banks.add(f.bank.name)
+            summary = files.summarize()
+            updated_count = summary['count']
+            details = []
+            if summary['projects']:
+                details.append(f"Projects: {', '.join(str(p) for p in sorted(summary['projects']))}")
+            if summary['scans']:
+                details.append(f"Scans: {', '.join(str(s) for s in sorted(summary['scans']))}")
+            if summary['banks']:
+                details.append(f"Banks: {', '.join(str(b) for b in sorted(summary['banks']))}")
+            detail_str = "; ".join(details)
             if updated_count == 0:
                 message = { 'text': "No files matched", 'color': "red" }
+            elif updated_count > MARK_FILES_DELETED_BACKGROUND_THRESHOLD:
+                params = dict(form.get_params(), details=detail_str)
+                job = startJob('mark_files_deleted', markFilesDeletedJob, updated_count, params=params)
+                messages.info(request, f"Marking {updated_count} files as deleted in the background (job {job.id}). {detail_str}")
             else:
-                details = []
-                if affected_projects:
-                    details.append(f"Projects: {', '.join(str(p) for p in affected_projects)}")
-                if affected_scans:
-                    details.append(f"Scans: {', '.join(str(s) for s in affected_scans)}")
-                if affected_banks:
-                    details.append(f"Banks: {', '.join(str(b) for b in affected_banks)}")
-                detail_str = "; ".join(details)
+                with transaction.atomic():
+                    files.update(deleted=True)
                 messages.success(request, f"Marked {updated_count} files as deleted. {detail_str}")
-    return render(request, 'mdb/mark_files_deleted.html', {'form': form, 'message': message, 'warning': warning})
+    return render(request, 'mdb/mark_files_deleted.html', {'form': form, 'message': message, 'warning': warning, 'job': job})
+
+def job_progress(request, pk):
+    "JSON progress of a BackgroundJob, for polling"
+    job = get_object_or_404(BackgroundJob, pk=pk)
+    # the process running it may have been restarted
+    job.failIfStale()
+    return JsonResponse({
+        'id': job.id,
+        'kind': job.kind,
+        'state': job.state,
+        'total': job.total,
+        'done': job.done,
+        'percent': round(job.percentDone(), 1),
+        'finished': job.isFinished(),
+        'result': job.result,
+    })
 from django.shortcuts import redirect
 from .forms import ProcessingStateForm
+from .models import ProcessingStateChange
 def set_processing_state(request):
     form = ProcessingStateForm(request.POST or None)
     message = None
@@ -50,11 +79,7 @@ def set_processing_state(request):
         else:
             processing_objs = form.get_processing_objects()
             new_state = form.cleaned_data['processedState']
-            updated_count = 0
-            for p in processing_objs:
-                p.processedState = new_state
-                p.save()
-                updated_count += 1
+            updated_count = ProcessingStateChange.setState(processing_objs, new_state)
             if updated_count == 0:
                 message = { 'text': "No objects matched", 'color': "red" }
             else:
@@ -66,38 +91,161 @@ class ProcessingDetailView(DetailView):
     model = Processing
     template_name = 'mdb/processing_detail.html'
     context_object_name = 'processing'
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['stateChanges'] = self.object.stateChanges.order_by('-changeTime', '-id')
+        return context
+from django.db.models import Count, Q, Sum
 from django.views.generic import DetailView
-from .models import Scan
+from .models import Scan, ScanSummary
 class ScanDetailView(DetailView):
     model = Scan
     template_name = 'mdb/scan_detail.html'
     context_object_name = 'scan'
 
+    def get_queryset(self):
+        return super().get_queryset().select_related('summary')
+
     def get_context_data(self, **kwargs):
+        "A fixed number of queries, however many files the scan has"
         context = super().get_context_data(**kwargs)
         scan = self.object
-        context['files'] = scan.file_set.all()
-        context['qualitychecks'] = getattr(scan, 'qualitycheck_set', None)
-        if context['qualitychecks'] is not None:
-            context['qualitychecks'] = scan.qualitycheck_set.all()
-        else:
-            context['qualitychecks'] = []
-        context['processing'] = scan.processing_set.all()
+        context['files'] = scan.file_set.select_related('bank').order_by('bank__name', 'creationTime', 'id')
+        context['qualitychecks'] = scan.getQualityChecks().select_related('file__bank')
+        context['processing'] = scan.processing_set.select_related('bank').order_by('bank__name')
+        context['banks'] = self.getBankBreakdown(scan)
         return context
+
+    def getBankBreakdown(self, scan):
+        "Per bank file counts and sizes in one grouped query, plus the summary's processing states"
+        try:
+            bankStates = scan.summary.bankStates
+        except ScanSummary.DoesNotExist:
+            bankStates = {}
+        banks = scan.file_set.order_by('bank__name').values('bank__name').annotate(
+            fileCount=Count('id'),
+            rawFileCount=Count('id', filter=Q(fileType='raw')),
+            deletedFileCount=Count('id', filter=Q(deleted=True)),
+            liveBytes=Sum('size', filter=Q(deleted=False)),
+        )
+        banks = list(banks)
+        for b in banks:
+            b['processedState'] = bankStates.get(b['bank__name'])
+        return banks
 from django.shortcuts import render
 from django.views.generic import ListView
 from .models import Scan
 
+# keyset pagination page sizes; can be overriden with ?pageSize=
+SCAN_LIST_PAGE_SIZE = 50
+SCAN_LIST_MAX_PAGE_SIZE = 500
+
 class ScanListView(ListView):
     model = Scan
     template_name = 'mdb/scan_list.html'
     context_object_name = 'scans'
 
+    def get_page_size(self):
+        "Page size from the request, clamped to what the server allows"
+        try:
+            pageSize = int(self.request.GET.get('pageSize', SCAN_LIST_PAGE_SIZE))
+        except ValueError:
+            pageSize = SCAN_LIST_PAGE_SIZE
+        return max(1, min(pageSize, SCAN_LIST_MAX_PAGE_SIZE))
+
+    def get_cursor(self, name):
+        "The ?after= and ?before= params are scan ids; we need their (startTime, id)"
+        pk = self.request.GET.get(name)
+        if not pk or not pk.isdigit():
+            return None
+        return Scan.objects.filter(pk=int(pk)).values_list('startTime', 'id').first()
+
     def get_queryset(self):
         queryset = super().get_queryset()
         # Example filter: filter by projectId if provided in GET params
         project_id = self.request.GET.get('projectId')
         if project_id:
             queryset = queryset.filter(projectId=project_id)
-        return queryset
+        # the per scan stats come from the denormalized ScanSummary
+        return queryset.select_related('summary')
+
+    def get(self, request, *args, **kwargs):
+        pageSize = self.get_page_size()
+        after = self.get_cursor('after')
+        before = self.get_cursor('before') if after is None else None
+        # fetch one extra row to find out if there's another page
+        scans = list(self.get_queryset().seek(after=after, before=before)[:pageSize + 1])
+        hasMore = len(scans) > pageSize
+        scans = scans[:pageSize]
+        if before is not None:
+            scans.reverse()
+            hasNext, hasPrevious = True, hasMore
+        else:
+            hasNext, hasPrevious = hasMore, after is not None
+        self.object_list = scans
+        projectId = request.GET.get('projectId')
+        context = self.get_context_data(
+            pageSize=pageSize,
+            nextAfter=scans[-1].id if scans and hasNext else None,
+            previousBefore=scans[0].id if scans and hasPrevious else None,
+            projectTotals=ScanSummary.projectTotals(projectId) if projectId else None,
+        )
+        return self.render_to_response(context)
 # Create your views here.
+import hashlib
+import json
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+from django.utils.http import quote_etag
+from django.views.decorators.http import condition
+from . import heartbeats
+from .models import BankStatus, HostProcessSnapshot, Status
+
+# how long the control room status stays cached on the server
+STATUS_JSON_CACHE_KEY = 'mdb:status-json'
+STATUS_JSON_CACHE_SECONDS = getattr(settings, 'STATUS_JSON_CACHE_SECONDS', 2)
+
+def buildStatus():
+    "The Status singleton, all BankStatus rows and the host snapshots in three queries"
+    stored = heartbeats.getStored()
+    status = Status.objects.first()
+    banks = BankStatus.objects.select_related('bank', 'processing').order_by('bank__name')
+    snapshots = HostProcessSnapshot.forBanks()
+    return {
+        'status': None if status is None else {
+            'heartbeat': heartbeats.getHeartbeat(status, heartbeats.STATUS, stored),
+            'currentScanNum': status.currentScanNum,
+            'currentProjectId': status.currentProjectId,
+            'currentState': status.currentState,
+            'currentCycSpec': status.currentCycSpec,
+        },
+        'banks': [{
+            'bank': bs.bank.name,
+            'processingHeartbeat': heartbeats.getHeartbeat(bs, heartbeats.PROCESSING, stored),
+            'qualityCheckHeartbeat': heartbeats.getHeartbeat(bs, heartbeats.QUALITY_CHECK, stored),
+            'processingId': bs.processing_id,
+            'processedState': bs.processing.processedState if bs.processing else None,
+            'qualityCheckId': bs.qualityCheck_id,
+            # None if the poller hasn't seen this bank's host lately
+            'dspsrRunning': snapshots[bs.bank.name].isDspsrRunning() if bs.bank.name in snapshots else None,
+        } for bs in banks],
+    }
+
+def getStatusJson():
+    "(etag, body) for status_json, rebuilt at most every STATUS_JSON_CACHE_SECONDS"
+    cached = cache.get(STATUS_JSON_CACHE_KEY)
+    if cached is None:
+        body = json.dumps(buildStatus(), cls=DjangoJSONEncoder)
+        cached = (hashlib.md5(body.encode('utf-8')).hexdigest(), body)
+        cache.set(STATUS_JSON_CACHE_KEY, cached, STATUS_JSON_CACHE_SECONDS)
+    return cached
+
+@condition(etag_func=lambda request: getStatusJson()[0])
+def status_json(request):
+    "Compact status for the control room; unchanged state gets a 304"
+    etag, body = getStatusJson()
+    response = HttpResponse(body, content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    return response
@@ -0,0 +1,292 @@
+"""
+Ways of running the shell commands utils.py uses to probe the bank hosts.
+
+    * FabricTransport: SSH, over a pool of fabric Connections (the default)
+    * LocalTransport: a local subprocess, whatever the host
+    * SimulatedTransport: canned answers from in-memory process tables,
+      with configurable latency and failure rate, for benchmarks and load
+      tests without the VEGAS HPC hosts
+
+Pick one with settings.COMMAND_TRANSPORT ('fabric', 'local' or 'simulated';
+the latter takes it's keyword arguments from settings.SIMULATED_TRANSPORT),
+or call setTransport().  Every transport's run(host, cmd, hide=, warn=,
+timeout=) returns something with fabric Result's exited, stdout and
+stderr, and raises if the command takes longer than timeout seconds.
+"""
+import logging
+import os
+import random
+import re
+import subprocess
+import threading
+import time
+
+from fabric import Connection
+from paramiko.ssh_exception import SSHException
+
+from djangoTest import settings
+
+
+class CommandResult:
+    "The bits of a fabric Result we use"
+
+    def __init__(self, exited, stdout='', stderr=''):
+        self.exited = exited
+        self.stdout = stdout
+        self.stderr = stderr
+
+class Transport:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = self.failures = 0
+
+    def run(self, host, cmd, hide=False, warn=False, timeout=None, **kwargs):
+        with self.lock:
+            self.calls += 1
+        try:
+            return self._run(host, cmd, hide=hide, warn=warn, timeout=timeout, **kwargs)
+        except Exception:
+            with self.lock:
+                self.failures += 1
+            raise
+
+    def _run(self, host, cmd, hide=False, warn=False, timeout=None, **kwargs):
+        raise NotImplementedError
+
+    def stats(self):
+        with self.lock:
+            return dict(calls=self.calls, failures=self.failures)
+
+def newConnection(host):
+    "A fabric Connection that won't hang forever on an unreachable host"
+    return Connection(host, connect_timeout=getattr(settings, 'SSH_CONNECT_TIMEOUT', 5))
+
+class ConnectionPool:
+    """
+    Process wide pool of fabric Connections, keyed by host, so that
+    repeated probes of the same host reuse it's authenticated transport
+    instead of paying for a new SSH handshake every time.
+    'connectionFactory' takes a host and returns something with a
+    fabric Connection's run(), close() and is_connected; tests can pass
+    a local stand-in.
+    """
+
+    # failures that mean the connection itself is no good
+    CONNECTION_ERRORS = (SSHException, EOFError, OSError)
+
+    def __init__(self, connectionFactory=None, maxIdle=None, idleTimeout=None):
+        self.connectionFactory = connectionFactory or newConnection
+        self.maxIdle = maxIdle if maxIdle is not None else getattr(settings, 'SSH_POOL_MAX_IDLE', 48)
+        self.idleTimeout = idleTimeout if idleTimeout is not None else getattr(settings, 'SSH_POOL_IDLE_TIMEOUT', 300)
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        # host -> list of (connection, time it was put back)
+        self.idle = {}
+        self.hits = self.misses = self.reconnects = self.evictions = 0
+
+    def _checkFork(self):
+        "A forked child must not share it's parent's SSH transports"
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.idle = {}
+            self.lock = threading.Lock()
+
+    def numIdle(self):
+        return sum([len(cs) for cs in self.idle.values()])
+
+    def acquire(self, host):
+        "An idle healthy connection to host, or a new one"
+        with self.lock:
+            self._checkFork()
+            conns = self.idle.get(host, [])
+            while conns:
+                conn, lastUsed = conns.pop()
+                if time.monotonic() - lastUsed < self.idleTimeout and conn.is_connected:
+                    self.hits += 1
+                    return conn
+                # stale or dead
+                self.evictions += 1
+                self._close(conn)
+            self.misses += 1
+        return self.connectionFactory(host)
+
+    def release(self, host, conn):
+        "Put a connection back for the next caller, evicting the oldest if we've got too many"
+        with self.lock:
+            self._checkFork()
+            self.idle.setdefault(host, []).append((conn, time.monotonic()))
+            while self.numIdle() > self.maxIdle:
+                oldestHost = min([h for h in self.idle if self.idle[h]], key=lambda h: self.idle[h][0][1])
+                oldConn, _ = self.idle[oldestHost].pop(0)
+                self.evictions += 1
+                self._close(oldConn)
+
+    def discard(self, conn):
+        self._close(conn)
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logging.error("Could not close connection: %s" % e)
+
+    def run(self, host, cmd, **kwargs):
+        "conn.run(cmd) on a pooled connection, reconnecting once if it has gone bad"
+        conn = self.acquire(host)
+        ok = False
+        try:
+            try:
+                result = conn.run(cmd, **kwargs)
+            except self.CONNECTION_ERRORS as e:
+                logging.error("Connection to %s failed (%s), reconnecting" % (host, e))
+                self.discard(conn)
+                conn = None
+                with self.lock:
+                    self.reconnects += 1
+                conn = self.connectionFactory(host)
+                result = conn.run(cmd, **kwargs)
+            ok = True
+            return result
+        finally:
+            # after anything else (a command that failed, or timed out and
+            # may still be running) we can't trust the connection's state
+            if ok:
+                self.release(host, conn)
+            elif conn is not None:
+                self.discard(conn)
+
+    def closeAll(self):
+        with self.lock:
+            self._checkFork()
+            for conns in self.idle.values():
+                for conn, _ in conns:
+                    self._close(conn)
+            self.idle = {}
+
+    def stats(self):
+        "Counters for seeing how well the pool is doing"
+        with self.lock:
+            return dict(hits=self.hits, misses=self.misses, reconnects=self.reconnects,
+                        evictions=self.evictions, idle=self.numIdle())
+
+class FabricTransport(Transport):
+    "Commands over SSH, reusing connections from a ConnectionPool"
+
+    def __init__(self, pool=None):
+        super().__init__()
+        self.pool = pool or ConnectionPool()
+
+    def _run(self, host, cmd, timeout=None, **kwargs):
+        # invoke raises CommandTimedOut if the command runs past timeout
+        return self.pool.run(host, cmd, timeout=timeout, **kwargs)
+
+    def stats(self):
+        return dict(super().stats(), **self.pool.stats())
+
+class LocalTransport(Transport):
+    "Commands in a local shell; the host is ignored"
+
+    def __init__(self, timeout=None):
+        super().__init__()
+        self.timeout = timeout
+
+    def _run(self, host, cmd, hide=False, warn=False, timeout=None, **kwargs):
+        p = subprocess.run(cmd, shell=True, capture_output=True, text=True, timeout=timeout or self.timeout)
+        if not hide:
+            print(p.stdout, end='')
+        if p.returncode != 0 and not warn:
+            raise subprocess.CalledProcessError(p.returncode, cmd, p.stdout, p.stderr)
+        return CommandResult(p.returncode, p.stdout, p.stderr)
+
+class SimulatedTransport(Transport):
+    """
+    Answers the commands utils.py sends ('/sbin/pidof <program>',
+    'ls /proc/<pid>' and 'cd /proc && ls -d <pids>') from
+    'processTables', a dict of {host: {pid: program name}}.
+    Each call sleeps for 'latency' seconds plus up to 'jitter' more
+    ('hostLatency' can override the latency of single hosts, say to make
+    one hang), and fails with an OSError with probability 'failureRate'.
+    A call that would sleep past it's timeout sleeps for the timeout and
+    raises TimeoutError instead.
+    """
+
+    PIDOF = re.compile(r'^/sbin/pidof (\S+)$')
+    LS_PROC = re.compile(r'^ls /proc/(\d+)$')
+    LS_PIDS = re.compile(r'^cd /proc && ls -d ([\d ]+?)(?: 2>/dev/null)?$')
+
+    def __init__(self, processTables=None, latency=0.0, jitter=0.0, failureRate=0.0, hostLatency=None, seed=None):
+        super().__init__()
+        self.processTables = processTables or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.failureRate = failureRate
+        self.hostLatency = hostLatency or {}
+        self.random = random.Random(seed)
+
+    def setProcesses(self, host, processes):
+        "Replace the {pid: program} table of host"
+        with self.lock:
+            self.processTables[host] = dict(processes)
+
+    def _run(self, host, cmd, hide=False, warn=False, timeout=None, **kwargs):
+        with self.lock:
+            delay = self.hostLatency.get(host, self.latency) + self.jitter * self.random.random()
+            fail = self.random.random() < self.failureRate
+            table = dict(self.processTables.get(host, {}))
+        if timeout is not None and delay > timeout:
+            time.sleep(timeout)
+            raise TimeoutError("simulated command on %s timed out after %s seconds" % (host, timeout))
+        time.sleep(delay)
+        if fail:
+            raise OSError("simulated connection failure to %s" % host)
+        result = self.answer(table, cmd.strip())
+        if result.exited != 0 and not warn:
+            raise subprocess.CalledProcessError(result.exited, cmd, result.stdout, result.stderr)
+        return result
+
+    def answer(self, table, cmd):
+        m = self.PIDOF.match(cmd)
+        if m:
+            pids = sorted([pid for pid, program in table.items() if program == m.group(1)])
+            if not pids:
+                return CommandResult(1)
+            return CommandResult(0, " ".join([str(p) for p in pids]) + "\n")
+        m = self.LS_PROC.match(cmd)
+        if m:
+            if int(m.group(1)) in table:
+                return CommandResult(0, "cwd\nexe\n")
+            return CommandResult(2, stderr="No such file or directory\n")
+        m = self.LS_PIDS.match(cmd)
+        if m:
+            pids = [int(p) for p in m.group(1).split()]
+            found = [p for p in pids if p in table]
+            return CommandResult(0 if len(found) == len(pids) else 2,
+                                 "".join(["%d\n" % p for p in found]))
+        return CommandResult(127, stderr="simulated transport doesn't know: %s\n" % cmd)
+
+TRANSPORTS = {
+    'fabric': FabricTransport,
+    'local': LocalTransport,
+    'simulated': SimulatedTransport,
+}
+
+_transport = None
+_transportLock = threading.Lock()
+
+def getTransport():
+    "The process wide transport, made from settings.COMMAND_TRANSPORT the first time"
+    global _transport
+    with _transportLock:
+        if _transport is None:
+            name = getattr(settings, 'COMMAND_TRANSPORT', 'fabric')
+            kwargs = getattr(settings, 'SIMULATED_TRANSPORT', {}) if name == 'simulated' else {}
+            _transport = TRANSPORTS[name](**kwargs)
+        return _transport
+
+def setTransport(transport):
+    "Use this transport from now on; returns the previous one"
+    global _transport
+    with _transportLock:
+        previous, _transport = _transport, transport
+    return previous
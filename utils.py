@@ -1,14 +1,24 @@
+import bisect
 import glob
+import hashlib
 import os
 import shlex
+import struct
 import subprocess
+import tempfile
 import configparser
-from multiprocessing import Pool
+import functools
+import re
+import threading
+import time
+from types import MappingProxyType
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from datetime import datetime, timezone
 
-from fabric import Connection
+from django.core.cache import caches
 
 from djangoTest import settings
+from transports import getTransport
 
 import logging
 
@@ -26,25 +36,174 @@ LBW_MODES.extend(['MODEc0200x%s' % bw for bw in bws])
 
 DSPSR_EXE = 'dspsr.12Jul2022'
 
+NUMBANKS = 3*8
+BANKNAMES = [chr(ord('A')+i) for i in range(NUMBANKS)]
+
+# what a probe returns for a host we couldn't reach in time
+PROBE_UNKNOWN = 'UNKNOWN'
+
+# the per host timeout of the probe running in this thread, for runOnHost
+probeContext = threading.local()
+
+class ProbeExecutor:
+    """
+    Runs a blocking probe (like isDspsrRunning) against many hosts at once,
+    on a reusable pool of at most 'maxWorkers' threads.  Hosts that
+    raise, or don't answer within 'timeout' seconds of the batch being
+    submitted, come back as PROBE_UNKNOWN.  The timeout is passed on to
+    the transport, so a hung host gives it's thread back.  A probe that
+    another call is already running (say, one first() stopped waiting
+    for) is waited on rather than run again, and a host with a probe
+    that has overrun it's timeout is skipped until that one finishes.
+    """
+
+    def __init__(self, maxWorkers=None, timeout=None):
+        self.maxWorkers = maxWorkers or getattr(settings, 'PROBE_MAX_WORKERS', 24)
+        self.timeout = timeout or getattr(settings, 'PROBE_TIMEOUT', 10)
+        self.lock = threading.Lock()
+        self.pid = None
+        self.executor = None
+        # host -> {future: [fn, time.monotonic() it started or None, timeout]}
+        self.inFlight = {}
+        self.inFlightLock = threading.RLock()
+
+    def getExecutor(self):
+        "Threads don't survive a fork, so a child needs it's own executor"
+        with self.lock:
+            if self.executor is None or self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.executor = ThreadPoolExecutor(max_workers=self.maxWorkers, thread_name_prefix='probe')
+                self.inFlight = {}
+                self.inFlightLock = threading.RLock()
+            return self.executor
+
+    @staticmethod
+    def probe(fn, host, timeout, running):
+        running[1] = time.monotonic()
+        probeContext.timeout = timeout
+        try:
+            return fn(host)
+        finally:
+            probeContext.timeout = None
+
+    def finished(self, host, future):
+        with self.inFlightLock:
+            probes = self.inFlight.get(host, {})
+            probes.pop(future, None)
+            if not probes:
+                self.inFlight.pop(host, None)
+
+    def isHung(self, host, now=None):
+        "Has a probe of host been running for longer than it's timeout?"
+        now = now or time.monotonic()
+        with self.inFlightLock:
+            return any([started is not None and now - started > timeout
+                        for fn, started, timeout in self.inFlight.get(host, {}).values()])
+
+    def submit(self, fn, hosts, timeout=None):
+        """
+        [(host, future)]: a new probe of each host, or the same probe
+        already running, or None for hosts that look hung
+        """
+        executor = self.getExecutor()
+        timeout = timeout or self.timeout
+        now = time.monotonic()
+        futures = []
+        with self.inFlightLock:
+            for host in hosts:
+                if self.isHung(host, now):
+                    logging.error("Probe of %s has overrun it's timeout, skipping it" % host)
+                    futures.append((host, None))
+                    continue
+                probes = self.inFlight.setdefault(host, {})
+                running = [f for f, (probeFn, _, _) in probes.items() if probeFn is fn]
+                if running:
+                    futures.append((host, running[0]))
+                    continue
+                record = [fn, None, timeout]
+                f = executor.submit(self.probe, fn, host, timeout, record)
+                probes[f] = record
+                f.add_done_callback(lambda f, host=host: self.finished(host, f))
+                futures.append((host, f))
+        return futures
+
+    def numInFlight(self):
+        with self.inFlightLock:
+            return sum([len(probes) for probes in self.inFlight.values()])
+
+    @staticmethod
+    def result(host, future):
+        "A finished future's result, or PROBE_UNKNOWN if it failed"
+        try:
+            return future.result(timeout=0)
+        except Exception as e:
+            logging.error("Probe of %s failed: %s" % (host, e))
+            return PROBE_UNKNOWN
+
+    def map(self, fn, hosts, timeout=None):
+        "[fn(host) for host in hosts], run concurrently"
+        timeout = timeout or self.timeout
+        futures = self.submit(fn, hosts, timeout)
+        wait([f for h, f in futures if f is not None], timeout=timeout)
+        results = []
+        for host, f in futures:
+            if f is None:
+                results.append(PROBE_UNKNOWN)
+            elif not f.done():
+                logging.error("Probe of %s timed out after %s seconds" % (host, timeout))
+                results.append(PROBE_UNKNOWN)
+            else:
+                results.append(self.result(host, f))
+        return results
+
+    def first(self, fn, hosts, predicate, timeout=None):
+        """
+        Returns (host, result, unknown) for the first host whose fn(host)
+        satisfies predicate, without waiting for the rest, or
+        (None, None, unknown) if none do.  'unknown' lists the hosts
+        that failed, timed out or were skipped so far.
+        """
+        timeout = timeout or self.timeout
+        deadline = time.monotonic() + timeout
+        submitted = self.submit(fn, hosts, timeout)
+        unknown = [host for host, f in submitted if f is None]
+        futures = dict([(f, host) for host, f in submitted if f is not None])
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=max(0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for f in done:
+                result = self.result(futures[f], f)
+                if result == PROBE_UNKNOWN:
+                    unknown.append(futures[f])
+                elif predicate(result):
+                    return futures[f], result, unknown
+        for f in pending:
+            logging.error("Probe of %s timed out after %s seconds" % (futures[f], timeout))
+            unknown.append(futures[f])
+        return None, None, unknown
+
+probeExecutor = ProbeExecutor()
+
 def detectCSProcessing(banks):
-    "Is CS processing going on on any of the banks?"
-    # TBF: how to make this faster?
-    # for bank in Bank.objects.all().order_by('name'):
-    #     host = getBankHost(bank.name)
-    #     pid = isProgramRunning(host, 'dspsr.12Jul2022')
-    #     p = None
-    #     if pid is not None:
-    #         logging.info()
+    """
+    Is CS processing going on on any of the banks?
+    Returns as soon as one host reports a running dspsr.  If none do,
+    but some hosts could not be reached, returns PROBE_UNKNOWN, which,
+    being truthy, errs on the side of assuming processing is going on.
+    """
     hosts = getBankHosts(banks)
-    with Pool(processes=len(banks)) as pool:
-        csPids = pool.map(isDspsrRunning, hosts)
-    return not all([pid is None for pid in csPids])
-
+    host, pid, unknown = probeExecutor.first(isDspsrRunning, hosts, lambda pid: pid is not None)
+    if host is not None:
+        return True
+    return PROBE_UNKNOWN if unknown else False
 
 def getBankHosts(banks):
     "Return the host names for Banks A, B, ..."
     #return [getBankHost(b.name) for b in Bank.objects.all().order_by('name')]
-    return [getBankHost(b) for b in banks] #Bank.objects.all().order_by('name')]
+    hostMap = getBankHostMap()
+    return [hostMap[b] if b in hostMap else getBankHost(b) for b in banks] #Bank.objects.all().order_by('name')]
 
 #def getProcessingPidInfo(host):
 #    pid = isDspsrRunning(host)
@@ -74,10 +233,9 @@ def getProcessingPids(banks):
     #     print("dspsr running on host %s as %s" % (host, pid))
     #     dspsrPids.append((bank.name, host, pid, p))
     # return dspsrPids
+    # each is a pid, None, or PROBE_UNKNOWN if we couldn't tell
     hosts = getBankHosts(banks)
-    with Pool(processes=len(banks)) as pool:
-        pids = pool.map(isDspsrRunning, hosts)
-    return pids
+    return probeExecutor.map(isDspsrRunning, hosts)
 
 def parseDiskUsageStr(usageStr, cmd, path):
     """
@@ -135,21 +293,131 @@ def parseDiskUsageStr(usageStr, cmd, path):
     return (nums[0], nums[1], nums[2], percent)
 
 def getDiskUsage(path):
-    "Use call to 'df' to check on disk usage"
-    result = (None, None, None, None)
-    cmds = ["df", path, "-H"]
-    cmd = " ".join(cmds)
-    s = subprocess.run(cmds, capture_output=True)
-    if s.returncode != 0:
-        logging.error("cmd %s failed with error code: %d" % (cmd, s.returncode))
-        return result
-    # figure out what it is from the stdout
-    try:
-        out = s.stdout.decode('UTF-8')
-    except:
-        logging.error("cmd %s failed to produce sensible output" % cmd)
-        return  result
-    return parseDiskUsageStr(out, cmd, path)
+    """
+    Like 'df path -H', but from statvfs: returns tuple of
+    Size(T), Usage(T), Available(T), percent used.
+    """
+    usage = diskUsageSampler.sampleMounts({path: path})[path]
+    if usage is None:
+        return (None, None, None, None)
+    T = 1e12
+    return (usage['total'] / T, usage['used'] / T, usage['available'] / T, usage['percent'])
+
+def statDisk(path):
+    "Exact byte counts for the file system path is on"
+    st = os.statvfs(path)
+    total = st.f_blocks * st.f_frsize
+    used = total - st.f_bfree * st.f_frsize
+    # what's left for us; root gets a bit more
+    available = st.f_bavail * st.f_frsize
+    # the way df does it
+    percent = 100.0 * used / (used + available) if used + available else 0.0
+    return dict(total=total, used=used, available=available, percent=percent)
+
+class DiskUsageSampler:
+    """
+    statvfs of the internal and external mounts from cycspec.conf, all
+    at once on a small executor of it's own, and cached for 'ttl'
+    seconds.  A mount that doesn't answer within the timeout is None
+    until it does; it keeps at most one thread stuck, since it isn't
+    statted again while that's still going.  Fresh samples are also added
+    to a (unix time, used bytes) series per mount, up to 'historyLength'
+    of them, kept in the shared DISK_USAGE_CACHE for fill rates; the
+    sample_disk_usage command keeps it filled.
+    """
+
+    def __init__(self, ttl=None, historyLength=None, maxWorkers=None, timeout=None):
+        self.ttl = ttl or getattr(settings, 'DISK_USAGE_TTL', 60)
+        self.historyLength = historyLength or getattr(settings, 'DISK_USAGE_HISTORY', 1440)
+        self.executor = ProbeExecutor(maxWorkers=maxWorkers or getattr(settings, 'DISK_USAGE_WORKERS', 4),
+                                      timeout=timeout)
+        self.lock = threading.Lock()
+        # path -> (time.monotonic() of sample, statDisk(path), or None if that failed)
+        self.samples = {}
+
+    @staticmethod
+    def getCache():
+        return caches[getattr(settings, 'DISK_USAGE_CACHE', 'default')]
+
+    @staticmethod
+    def historyKey(path):
+        return 'disk_usage_history:%s' % hashlib.md5(path.encode()).hexdigest()
+
+    @staticmethod
+    def getMounts():
+        "{name: path} of the mounts from cycspec.conf; the internal one is called 'internal'"
+        c = readConfig()
+        if c is None:
+            return {}
+        mounts = {}
+        if c.has_section('ExternalMounts'):
+            defaults = c.defaults()
+            # a section also has all the DEFAULT values in it
+            mounts.update([(k, v) for k, v in c.items('ExternalMounts') if k not in defaults])
+        if 'INTERNAL_MOUNT' in c['DEFAULT']:
+            mounts['internal'] = c['DEFAULT']['INTERNAL_MOUNT']
+        return mounts
+
+    def sampleMounts(self, mounts=None, maxAge=None):
+        """
+        {name: statDisk(path) or None if we couldn't} for {name: path}, by
+        default getMounts(), reusing samples up to maxAge (default ttl) seconds old
+        """
+        if mounts is None:
+            mounts = self.getMounts()
+        maxAge = self.ttl if maxAge is None else maxAge
+        now = time.monotonic()
+        with self.lock:
+            stale = sorted(set([p for p in mounts.values()
+                                if p not in self.samples or now - self.samples[p][0] >= maxAge]))
+        if stale:
+            results = self.executor.map(statDisk, stale)
+            wallTime = int(time.time())
+            with self.lock:
+                for path, usage in zip(stale, results):
+                    if usage == PROBE_UNKNOWN:
+                        # don't serve an old sample for a mount that's gone away,
+                        # but don't wait on it again until the ttl is up either
+                        self.samples[path] = (now, None)
+                    else:
+                        self.samples[path] = (now, usage)
+            for path, usage in zip(stale, results):
+                if usage != PROBE_UNKNOWN:
+                    self.record(path, wallTime, usage['used'])
+        with self.lock:
+            return dict([(name, self.samples[p][1]) for name, p in mounts.items()])
+
+    def record(self, path, wallTime, used):
+        "Add a sample to path's history, unless another process just did"
+        try:
+            cache = self.getCache()
+            key = self.historyKey(path)
+            series = cache.get(key) or []
+            if series and wallTime - series[-1][0] < self.ttl / 2:
+                return
+            series.append((wallTime, used))
+            cache.set(key, series[-self.historyLength:], None)
+        except Exception as e:
+            logging.error("Could not save disk usage of %s: %s" % (path, e))
+
+    def getHistory(self, path):
+        "[(unix time, used bytes), ...] for path, oldest first"
+        try:
+            return [tuple(s) for s in self.getCache().get(self.historyKey(path)) or []]
+        except Exception as e:
+            logging.error("Could not read disk usage history of %s: %s" % (path, e))
+            return []
+
+    def fillRate(self, path, window=None):
+        "Bytes per second path has been filling up over the last 'window' seconds of history"
+        series = self.getHistory(path)
+        if window is not None and series:
+            series = [s for s in series if s[0] >= series[-1][0] - window]
+        if len(series) < 2 or series[-1][0] == series[0][0]:
+            return None
+        return float(series[-1][1] - series[0][1]) / (series[-1][0] - series[0][0])
+
+diskUsageSampler = DiskUsageSampler()
 
 def isLBWMode(mode):
     return mode in LBW_MODES
@@ -174,57 +442,85 @@ def parsePulsarFilename(filename, fitsType):
     else:
         return parsePulsarRawFilename(filename)
 
+class PulsarFilename:
+    """
+    What's in a VEGAS pulsar data file name.  These are shared (see
+    parsePulsarName), so treat them as read only.
+    """
+    __slots__ = ('mjd', 'seconds', 'source', 'scanNum', 'cal', 'fileNum', 'extension')
+
+    def __init__(self, mjd, seconds, source, scanNum, cal, fileNum, extension):
+        self.mjd = mjd
+        self.seconds = seconds
+        self.source = source
+        self.scanNum = scanNum
+        self.cal = cal
+        self.fileNum = fileNum
+        self.extension = extension
+
+    def __eq__(self, other):
+        return isinstance(other, PulsarFilename) and all(
+            getattr(self, a) == getattr(other, a) for a in self.__slots__)
+
+    def __repr__(self):
+        return "PulsarFilename(%s)" % ", ".join(["%s=%r" % (a, getattr(self, a)) for a in self.__slots__])
+
+# vegas_(mjd)_(seconds)_(source)_(scan)[_cal]_(filenum).fits
+# vegas_(mjd)_(seconds)_(source)_(scan)[_cal].(filenum).raw
+# The source can have underscores in it; the scan is the last
+# '_' separated number before the file number.
+PULSAR_FILENAME_RE = re.compile(r"""
+    [^_]+
+    _(\d+)          # mjd
+    _(\d+)          # seconds
+    _(.+?)          # source
+    _(\d+)          # scan
+    (_cal)?
+    (?:_(\d+)\.fits|\.(\d+)\.raw)
+    """, re.VERBOSE)
+
+@functools.lru_cache(maxsize=getattr(settings, 'PULSAR_FILENAME_CACHE_SIZE', 65536))
+def parsePulsarName(filename):
+    "filename -> PulsarFilename; raises ValueError if it's not a pulsar data file name"
+    m = PULSAR_FILENAME_RE.fullmatch(filename)
+    if m is None:
+        raise ValueError("Not a VEGAS pulsar data file name: %s" % filename)
+    mjd, seconds, source, scanNum, cal, fitsFileNum, rawFileNum = m.groups()
+    if fitsFileNum is not None:
+        return PulsarFilename(int(mjd), int(seconds), source, int(scanNum), cal is not None, int(fitsFileNum), 'fits')
+    return PulsarFilename(int(mjd), int(seconds), source, int(scanNum), cal is not None, int(rawFileNum), 'raw')
+
+def parseMany(filenames):
+    "[PulsarFilename, or None if it isn't one, for each of filenames]"
+    parsed = []
+    # save the attribute lookups in the loop
+    parse = parsePulsarName
+    append = parsed.append
+    for fn in filenames:
+        try:
+            append(parse(fn))
+        except ValueError:
+            append(None)
+    return parsed
+
 def parsePulsarFitsFilename(filename):
     """
     Parse names like:
        * vegas_59956_65259_J0340+4130_0004_0001.fits
        * vegas_59956_48356_CAL_0011_cal_0001.fits
-    To get the:
-       * extension
-       * scan number
-       * file number
-
-    Pattern seems to be: vegasJ_(time)_(stamp)_(source)_(scan)[_cal_]_(filenum).(extension)
+    To get the scan number and file number.
     """
-
-    # first see if this is a 'cal' scan
-    extOffset = -4
-    calOffset = -13
-    scanIdx = 4
-    if 'cal' in filename and filename[calOffset:calOffset+3] == 'cal':
-        fileNumIdx = scanIdx + 2
-    else:
-        fileNumIdx = scanIdx + 1
-
-    thisScanNum = int(filename.split('_')[scanIdx])
-    fileNum = filename.split('_')[fileNumIdx]
-    thisFileNum = int(fileNum.split('.')[0])
-
-    return thisScanNum, thisFileNum
+    p = parsePulsarName(filename)
+    return p.scanNum, p.fileNum
 
 def parsePulsarRawFilename(filename):
     """
     Parse names like:
        * vegas_59956_65259_J0340+4130_0004.0000.raw
-    To get the:
-       * extension
-       * scan number
-       * file number
-
-    Pattern seems to be: vegasJ_(time)_(stamp)_(source)_(scan).(filenum).(extension)
+    To get the scan number and file number.
     """
-
-    # first see if this is a 'cal' scan
-    extOffset = -3
-    scanIdx = 4
-
-    # f = 'vegas_59870_72107_none_0084.0000.raw'
-    end = filename.split('_')[scanIdx]
-    # end = '0084.0000.raw'
-    thisScanNum = int(end.split('.')[0])
-    thisFileNum = int(end.split('.')[1])
-
-    return thisScanNum, thisFileNum
+    p = parsePulsarName(filename)
+    return p.scanNum, p.fileNum
 
 def getDt(dt=None):
     "Make sure the datetime obj is tz-aware w/ UTC"
@@ -241,27 +537,98 @@ def formatDt( dt, frmt=None):
         frmt = '%Y-%m-%d %H:%M:%S'
     return dt.strftime(frmt)
 
+class ConfigCache:
+    """
+    Config files parsed with 'parse', keyed by path.  A file is parsed
+    again only when its mtime, inode or size changes (an edit in place,
+    or a new file moved over it), so callers can ask for it as often
+    as they like.  The parsed value is shared: don't modify it.
+    With a 'checkInterval', a file is stat'd for changes at most that
+    often (seconds), so most lookups do no I/O at all.
+    """
+
+    def __init__(self, parse, checkInterval=0):
+        self.parse = parse
+        self.checkInterval = checkInterval
+        self.lock = threading.Lock()
+        # path -> ((mtime, inode, size), parsed value, when we last stat'd it)
+        self.entries = {}
+        self.parses = 0
+        self.hits = 0
+
+    @staticmethod
+    def fileKey(path):
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def get(self, path):
+        "The parsed contents of path, parsing it only if it's changed"
+        now = time.monotonic()
+        if self.checkInterval:
+            with self.lock:
+                entry = self.entries.get(path)
+                if entry is not None and now - entry[2] < self.checkInterval:
+                    self.hits += 1
+                    return entry[1]
+        key = self.fileKey(path)
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.entries[path] = (key, entry[1], now)
+                self.hits += 1
+                return entry[1]
+            value = self.parse(path)
+            self.entries[path] = (key, value, now)
+            self.parses += 1
+            return value
+
+    def invalidate(self, path=None):
+        "Forget path, or everything, so it's parsed again on next use"
+        with self.lock:
+            if path is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(path, None)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.parses + self.hits
+            return dict(files=len(self.entries), parses=self.parses, hits=self.hits,
+                        hitRate=float(self.hits) / lookups if lookups else None)
+
+def parseConfig(filePath):
+    c = configparser.ConfigParser()
+    c.read(filePath)
+    return c
+
+configCache = ConfigCache(parseConfig)
+
+def parseKeyValueConfig(filePath):
+    "A YGOR config file's 'key := value' lines as {key: [value, ...]}"
+    index = {}
+    with open(filePath, 'r') as f:
+        for l in f:
+            if "#" == l[0]:
+                # skip comments
+                continue
+            if ":=" not in l:
+                # skip these too
+                continue
+            ll = l.split(":=")
+            index.setdefault(ll[0].strip(), []).append(ll[1])
+    return index
+
+# system.conf hardly ever changes, so don't even stat it every time
+keyValueCache = ConfigCache(parseKeyValueConfig,
+                            checkInterval=getattr(settings, 'SYSTEM_CONF_CHECK_INTERVAL', 5))
+
 # we have code everywhere for reading YGOR config files,
 # but not in this repo!
 def getConfigValue(ygorDir, configFile, key):
     "Extract a value from a file 'configFile' in a dir 'ygorDir' that has 'key' := 'value'"
     fn = os.path.join(ygorDir, configFile)
-    with open(fn, 'r') as f:
-        ls = f.readlines()
     # get any values for the given key
-    values = []
-    for l in ls:
-        if "#" == l[0]:
-            # skip comments
-            continue
-        if ":=" not in l:
-            # skip these too
-            continue
-        ll = l.split(":=")
-        thisKey = ll[0].strip()
-        if key == thisKey:
-            # here's one value for the key we're looking for
-            values.append(ll[1])
+    values = keyValueCache.get(fn).get(key, [])
     if len(values) != 1:
         logging.error("Expected just one occurence of %s, found %d" % (key, len(values)))
         return None
@@ -269,7 +636,7 @@ def getConfigValue(ygorDir, configFile, key):
         return values[0]
 
 def readConfig(guppiConfigFile=None, ygorPath=None):
-    "For reading a standard python config"
+    "For reading a standard python config; only parsed again once the file changes"
     if ygorPath is None:
         YT = 'YGOR_TELESCOPE'
         if YT in os.environ:
@@ -283,9 +650,7 @@ def readConfig(guppiConfigFile=None, ygorPath=None):
     if not os.path.isfile(filePath):
         logging.error("Could not find config file: %s" % filePath)
         return None
-    c = configparser.ConfigParser()
-    c.read(filePath)
-    return c
+    return configCache.get(filePath)
 
 def getExternalMounts(filename=None, ygorPath=None):
     c = readConfig(guppiConfigFile=filename, ygorPath=ygorPath)
@@ -538,21 +903,60 @@ def startProcessingWithDspsr(
 
 def getBankHost(bankName):
     "From system.conf, 'A' -> 'vegas-hpc11'"
+    host = getBankHostMap().get(bankName)
+    if host is not None:
+        return host
 
-    # assert bankName is legal
-
+    # not a bank, or not (just once) in system.conf: the slow way,
+    # which logs why
     # 'A' -> entry in system.conf
     entry = "VegasBank%sHost" % bankName
     return getSystemHost(entry)
 
+def getSystemConfPath():
+    return os.path.join(settings.YGOR_TELESCOPE, 'etc/config', 'system.conf')
+
+def parseHost(value):
+    "A system.conf host value without whitespace or quotes: ' \"vegas-hpc11\"\\n' -> 'vegas-hpc11'"
+    return value.strip()[1:-1]
+
 def getSystemHost(entry):
     "Get the host name of something in system.conf"
     ygorDir = os.path.join(settings.YGOR_TELESCOPE, 'etc/config')
     host = getConfigValue(ygorDir, "system.conf", entry)
-    # remove whitespace and quotes from
-    # ' "vegas-hpc11"\n'
-    host = host.strip()
-    return host[1:-1]
+    return parseHost(host)
+
+# system.conf path -> (the parsed system.conf, {bank name: host} built from it)
+bankHostMaps = {}
+bankHostMapsLock = threading.Lock()
+
+def getBankHostMap():
+    """
+    Read only {bank name: host} for all the BANKNAMES in system.conf.
+    Only rebuilt when system.conf is parsed again.
+    """
+    fn = getSystemConfPath()
+    index = keyValueCache.get(fn)
+    with bankHostMapsLock:
+        cached = bankHostMaps.get(fn)
+        if cached is not None and cached[0] is index:
+            return cached[1]
+        hosts = {}
+        for b in BANKNAMES:
+            values = index.get("VegasBank%sHost" % b, [])
+            if len(values) == 1:
+                hosts[b] = parseHost(values[0])
+        hostMap = MappingProxyType(hosts)
+        bankHostMaps[fn] = (index, hostMap)
+        return hostMap
+
+def runOnHost(host, cmd, **kwargs):
+    """
+    Run cmd on host with the configured transport (by default, pooled SSH
+    connections), giving up after the timeout of the probe we're in, if any
+    """
+    kwargs.setdefault('timeout', getattr(probeContext, 'timeout', None))
+    return getTransport().run(host, cmd, **kwargs)
 
 def isDspsrRunning(host):
     "Returns pid of dspsr found running on given host"
@@ -564,7 +968,7 @@ def isProgramRunning(host, program):
     #cmd = "ps -ef | grep %s | grep -v grep"
     cmd = "/sbin/pidof %s" % program
 
-    result = Connection(host).run(cmd, hide=False, warn=True)
+    result = runOnHost(host, cmd, hide=False, warn=True)
     # we can get more details from result.stdout, stderr ...
     if result.exited == 0:
         # try to find the PID!
@@ -592,6 +996,29 @@ def isProgramRunning(host, program):
         return None
 
 
+def getProgramPids(host, program):
+    "All the pids of the given program running on host"
+    result = runOnHost(host, "/sbin/pidof %s" % program, hide=True, warn=True)
+    if result.exited != 0:
+        return []
+    pids = []
+    for p in result.stdout.split():
+        try:
+            pids.append(int(p))
+        except ValueError:
+            logging.error("Could not convert PID: %s" % p)
+    return pids
+
+def probeHost(host, pids=None):
+    "Snapshot of dspsr and the given pids on host, and how long it took to find out"
+    start = time.monotonic()
+    dspsrPids = getProgramPids(host, DSPSR_EXE)
+    runningPids = getRunningPids(host, pids) if pids else set()
+    return dict(dspsrPids=sorted(dspsrPids),
+                checkedPids=sorted(set([int(p) for p in pids or []])),
+                runningPids=sorted(runningPids),
+                latency=time.monotonic() - start)
+
 def isPidRunning(pid, bankName):
     "Find out if the given pid is running on this bank's host"
 
@@ -610,10 +1037,48 @@ def isPidRunning(pid, bankName):
     # grep -v grep causes an error
     # so will using the proc dir if pid is not running
 
-    result = Connection(hostName).run(cmd, hide=False, warn=True)
+    result = runOnHost(hostName, cmd, hide=False, warn=True)
     # we can get more details from result.stdout, stderr ...
     return result.exited == 0
 
+def getRunningPids(host, pids):
+    "Which of the given pids are running on host?  One remote command for all of them"
+    pids = sorted(set([int(p) for p in pids]))
+    if len(pids) == 0:
+        return set()
+    # ls only lists the /proc dirs that exist, and fails if any don't
+    cmd = "cd /proc && ls -d %s 2>/dev/null" % " ".join([str(p) for p in pids])
+    result = runOnHost(host, cmd, hide=True, warn=True)
+    running = set()
+    for l in result.stdout.split():
+        try:
+            running.add(int(l))
+        except ValueError:
+            logging.error("Unexpected output from %s on %s: %s" % (cmd, host, l))
+    return running
+
+def arePidsRunning(bankPids):
+    "{(bankName, pid): is it running?} for many pairs, with one round trip per bank host, in parallel"
+    bankPids = list(bankPids)
+    hosts = dict([(b, getBankHost(b)) for b in set([b for b, pid in bankPids])])
+    pidsByHost = {}
+    for bankName, pid in bankPids:
+        if pid is not None:
+            pidsByHost.setdefault(hosts[bankName], set()).add(pid)
+    hostList = list(pidsByHost)
+    results = probeExecutor.map(lambda host: getRunningPids(host, pidsByHost[host]), hostList)
+    running = dict(zip(hostList, results))
+    status = {}
+    for b, pid in bankPids:
+        if pid is None:
+            status[(b, pid)] = False
+        elif running[hosts[b]] == PROBE_UNKNOWN:
+            # couldn't reach the host, so we don't know
+            status[(b, pid)] = None
+        else:
+            status[(b, pid)] = int(pid) in running[hosts[b]]
+    return status
+
 def getDtFromLogName(logName):
     "path/process.pid.timestamp -> datetime"
     fn = os.path.basename(logName)
@@ -624,13 +1089,47 @@ def getDtFromLogName(logName):
     utc = timezone.utc
     return dt.replace(tzinfo=utc)
 
+LOG_LEVELS = ['[DEBUG]','[INFO]','[WARNING]','[ERROR]','[FAULT]']
+
+# ('YYYY-MM-DD HH:MM:SS', it's datetime) of the last log line we saw;
+# consecutive lines are usually from the same second
+lastLogSecond = (None, None)
+
 def getDtFromLogLine(ln):
+    """
+    Return Datetime obj of timestamp at beginning of log line.
+    Lines laid out the way we log them:
+        2022-12-14 13:51:40,189 [utils] [INFO] dspsr cmd:
+    are decoded by position; anything else goes to getDtFromLogLineStrptime.
+    """
+    global lastLogSecond
+    if len(ln) > 25 and ln[19] == ',' and ln[23] == ' ' and ln[24] == '[':
+        # and the level is where it should be
+        i = ln.find('] [', 25)
+        if i != -1 and ln[i+2:ln.find(']', i+3)+1] in LOG_LEVELS:
+            ts = ln[:19]
+            last = lastLogSecond
+            if ts == last[0]:
+                return last[1]
+            digits = ts[0:4] + ts[5:7] + ts[8:10] + ts[11:13] + ts[14:16] + ts[17:19]
+            if ts[4] == '-' and ts[7] == '-' and ts[10] == ' ' and ts[13] == ':' and ts[16] == ':' \
+                    and digits.isdigit():
+                try:
+                    dt = datetime(int(ts[0:4]), int(ts[5:7]), int(ts[8:10]),
+                                  int(ts[11:13]), int(ts[14:16]), int(ts[17:19]), tzinfo=timezone.utc)
+                except ValueError:
+                    # let the slow way deal with it
+                    return getDtFromLogLineStrptime(ln)
+                lastLogSecond = (ts, dt)
+                return dt
+    return getDtFromLogLineStrptime(ln)
+
+def getDtFromLogLineStrptime(ln):
     "Return Datetime obj of timestamp at beginning of log line"
     # well, does it have a timestamp?  the logging we've
     # done so far always has the level in it, so use that
-    logLevels = ['[DEBUG]','[INFO]','[WARNING]','[ERROR]','[FAULT]']
     logLine = False
-    for level in logLevels:
+    for level in LOG_LEVELS:
         if level in ln:
             logLine = True
             break
@@ -645,42 +1144,197 @@ def getDtFromLogLine(ln):
     utc = timezone.utc
     return dt.replace(tzinfo=utc)
 
+def logLineTimestamp(f, offset):
+    """
+    (offset, datetime) of the first line with a timestamp that starts at
+    or after byte 'offset' of the log file f (opened 'rb'), or
+    (None, None) if there isn't one.
+    """
+    if offset > 0:
+        # skip the rest of the line that byte offset - 1 is in
+        f.seek(offset - 1)
+        f.readline()
+    else:
+        f.seek(0)
+    while True:
+        pos = f.tell()
+        line = f.readline()
+        if not line:
+            return None, None
+        dt = getDtFromLogLine(line.decode('utf-8', 'replace'))
+        if dt is not None:
+            return pos, dt
+
+def findLogOffset(f, start, lo=0, hi=None):
+    """
+    Byte offset of the first timestamped line at or after start in log
+    file f, by binary search; lo and hi narrow the search, if you know
+    it's in there.
+    """
+    if hi is None:
+        f.seek(0, os.SEEK_END)
+        hi = f.tell()
+    while lo < hi:
+        mid = (lo + hi) // 2
+        pos, dt = logLineTimestamp(f, mid)
+        if dt is None or dt >= start:
+            hi = mid
+        else:
+            lo = mid + 1
+    pos, dt = logLineTimestamp(f, lo)
+    return pos
+
+def readLogRange(fn, start, end=None, offset=None):
+    """
+    Generator of the lines in log file fn from the first one logged at
+    or after start, up to the last one logged at or before end (or the
+    end of the file).  Untimestamped lines (tracebacks, etc.) go with the
+    line before them.  Finds start by seeking, not reading, so the cost
+    is in the size of the window, not the file.  Pass 'offset' if you
+    already know where the window starts.
+    """
+    with open(fn, 'rb') as f:
+        pos = findLogOffset(f, start) if offset is None else offset
+        if pos is None:
+            # nothing that late in this file
+            return
+        firstPos, firstDt = logLineTimestamp(f, 0)
+        if firstPos == pos:
+            if end is not None and firstDt > end:
+                # the window's over before the log starts
+                return
+            # the whole log is in the window, including any preamble
+            pos = 0
+        f.seek(pos)
+        for line in f:
+            l = line.decode('utf-8', 'replace')
+            if end is not None:
+                dt = getDtFromLogLine(l)
+                if dt is not None and dt > end:
+                    return
+            yield l
+
+class LogIndex:
+    """
+    Sidecar index files for logs: the (epoch second, byte offset) of the
+    first timestamped line after every 'stride' bytes, so finding a time
+    takes a bisect, and a search of one stride of the log.  An index is brought up to date from
+    where it left off each time it's used, so it's cheap to keep current
+    as the log grows.  They're kept in 'indexDir', since the log dirs
+    aren't ours, and getCycspecLogFiles would take them for logs.
+    """
+    MAGIC = b'CSLI'
+    VERSION = 1
+    # magic, version, stride, log's inode, indexed up to this offset, # of entries
+    HEADER = struct.Struct('<4sIQQQQ')
+    # epoch second, byte offset
+    ENTRY = struct.Struct('<qQ')
+
+    def __init__(self, indexDir=None, stride=None):
+        self.indexDir = indexDir or getattr(settings, 'LOG_INDEX_DIR',
+                                            os.path.join(tempfile.gettempdir(), 'cycspec_log_index'))
+        self.stride = stride or getattr(settings, 'LOG_INDEX_STRIDE', 65536)
+        self.lock = threading.Lock()
+        # log path -> (inode, indexedTo, epochs, offsets)
+        self.indexes = {}
+
+    def getIndexPath(self, fn):
+        fn = os.path.abspath(fn)
+        digest = hashlib.sha1(fn.encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.indexDir, "%s.%s.idx" % (os.path.basename(fn), digest))
+
+    def load(self, fn):
+        "fn's index from it's sidecar, or None if there isn't a usable one"
+        try:
+            with open(self.getIndexPath(fn), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < self.HEADER.size:
+            return None
+        magic, version, stride, inode, indexedTo, n = self.HEADER.unpack_from(data)
+        if (magic, version, stride) != (self.MAGIC, self.VERSION, self.stride) or \
+                len(data) != self.HEADER.size + n * self.ENTRY.size:
+            return None
+        entries = list(self.ENTRY.iter_unpack(data[self.HEADER.size:]))
+        return (inode, indexedTo, [e for e, o in entries], [o for e, o in entries])
+
+    def save(self, fn, index):
+        "Replace fn's sidecar; readers see the old one or the new one, never half of one"
+        inode, indexedTo, epochs, offsets = index
+        path = self.getIndexPath(fn)
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        try:
+            os.makedirs(self.indexDir, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, self.stride, inode, indexedTo, len(epochs)))
+                f.write(b''.join([self.ENTRY.pack(e, o) for e, o in zip(epochs, offsets)]))
+            os.replace(tmp, path)
+        except OSError as e:
+            # we still have it in memory
+            logging.error("Could not save log index %s: %s" % (path, e))
+
+    def extend(self, fn, index):
+        "Index the rest of fn, from where index left off, up to it's last complete line"
+        inode, indexedTo, epochs, offsets = index
+        epochs, offsets = list(epochs), list(offsets)
+        nextEntry = offsets[-1] + self.stride if offsets else 0
+        with open(fn, 'rb') as f:
+            f.seek(indexedTo)
+            while True:
+                if f.tell() < nextEntry:
+                    # skip to the first line after the next stride boundary
+                    f.seek(nextEntry - 1)
+                    if not f.readline().endswith(b'\n'):
+                        break
+                    indexedTo = f.tell()
+                    continue
+                pos = f.tell()
+                line = f.readline()
+                if not line.endswith(b'\n'):
+                    # the end, or a line still being written; get it next time
+                    break
+                indexedTo = f.tell()
+                dt = getDtFromLogLine(line.decode('utf-8', 'replace'))
+                if dt is not None:
+                    epochs.append(int(dt.timestamp()))
+                    offsets.append(pos)
+                    nextEntry = pos + self.stride
+        return (inode, indexedTo, epochs, offsets)
+
+    def update(self, fn):
+        "fn's index, (inode, indexedTo, epochs, offsets), brought up to date"
+        st = os.stat(fn)
+        with self.lock:
+            index = self.indexes.get(fn) or self.load(fn)
+            if index is None or index[0] != st.st_ino or index[1] > st.st_size:
+                # new, or not the file we indexed
+                index = (st.st_ino, 0, [], [])
+            if index[1] < st.st_size:
+                indexedTo = index[1]
+                index = self.extend(fn, index)
+                if index[1] != indexedTo:
+                    self.save(fn, index)
+            self.indexes[fn] = index
+            return index
+
+    def find(self, fn, start):
+        "Byte offset of the first line logged at or after start in fn, or None if there isn't one"
+        inode, indexedTo, epochs, offsets = self.update(fn)
+        # what we want is between the last entry from before start and the next one
+        i = bisect.bisect_left(epochs, start.timestamp())
+        lo = offsets[i - 1] if i > 0 else 0
+        hi = offsets[i] if i < len(offsets) else None
+        with open(fn, 'rb') as f:
+            return findLogOffset(f, start, lo, hi)
+
+logIndex = LogIndex()
+
 def parseCycspecLogFile(fn, start, end=None):
     "Return those lines in the given file betwen given time range"
-    with open(fn, 'r') as f:
-        lines = f.readlines()
-    ls = []
-    startIdx = endIdx = None
-    firstDt = True
-    # if end is not specified, we want to go to last line
-    if end is None:
-        endIdx = len(lines)
-    for i, l in enumerate(lines):
-        dt = getDtFromLogLine(l)
-        #if dt is None and startIdx is None:
-            # if we haven't started, don't include
-        #    continue
-        if dt is None:
-            # no info with which to make a decision
-            continue
-        if dt < start:
-            firstDt = False
-            continue
-        if dt >= start and startIdx is None:
-            # start marking off what we want
-            # do we need to take into account stuff from before?
-            if firstDt:
-                firstDt = False
-                startIdx = 0
-            else:
-                startIdx = i
-        if end is not None and dt > end and endIdx is None:
-            endIdx = i
-    # if we didn't find the end, then we want it all
-    if endIdx is None:
-        endIdx = len(lines)
-    print("start, end, # lines: ", startIdx, endIdx, len(lines))
-    return lines[startIdx:endIdx]
+    lines = list(readLogRange(fn, start, end))
+    print("# lines: ", len(lines))
+    return lines
 
 def parseCycspecLogFiles(processName, host, start, end=None, ygorDir=None):
     "For the given host and time range, what are the logs for the given process?"
@@ -703,7 +1357,9 @@ def parseCycspecLogFiles(processName, host, start, end=None, ygorDir=None):
        #         lines.extend(f.readlines())
        # else:
             # we only want part of the file
-        lines.extend(parseCycspecLogFile(fn, start, end))
+        offset = logIndex.find(fn, start)
+        if offset is not None:
+            lines.extend(readLogRange(fn, start, end, offset=offset))
     return lines
 
 def getCycspecLogFiles(processName, host, start, end=None, ygorDir=None):